@@ -18,3 +18,7 @@
 
 
 import cli
+import memory
+
+
+__version__ = '0.1'
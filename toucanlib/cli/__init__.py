@@ -19,6 +19,9 @@
 
 import apps
 import commands
+import history
+import metrics
 import names
 import rendering
+import search
 import setup
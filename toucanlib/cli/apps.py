@@ -26,6 +26,112 @@ class Toucan(cliapp.Application):
 
     """The Toucan command line interface."""
 
+    def add_settings(self):
+        """Add Toucan specific settings."""
+        self.settings.boolean(
+            ['streaming'],
+            'parse setup files one entry at a time in order to reduce '
+            'memory usage for very large setup files')
+        self.settings.integer(
+            ['processes'],
+            'number of processes used to parse the files included by '
+            'setup files and to prepare objects when bulk loading boards '
+            '(default: one per CPU, except when bulk loading small boards)',
+            default=0)
+        self.settings.string(
+            ['setup-cache'],
+            'cache parsed setup files in DIR to speed up parsing '
+            'unchanged setup files again',
+            metavar='DIR')
+        self.settings.integer(
+            ['max-errors'],
+            'stop validating setup files after N errors '
+            '(default: report all errors)',
+            metavar='N',
+            default=0)
+        self.settings.boolean(
+            ['fail-fast'],
+            'stop validating setup files at the first error')
+        self.settings.integer(
+            ['batch-size'],
+            'populate new boards in a series of commits with about N '
+            'cards, comments and attachments each (default: populate '
+            'boards in a single commit)',
+            metavar='N',
+            default=0)
+        self.settings.boolean(
+            ['bulk-load'],
+            'write the objects of new boards into the git repository '
+            'directly instead of applying a transaction, which is faster '
+            'for large boards and streams attachments from disk instead '
+            'of holding them in memory, as needed for large attachments')
+
+        self.settings.boolean(
+            ['update'],
+            'update an existing board to match the setup file instead of '
+            'creating a new board')
+
+        self.settings.string(
+            ['author'],
+            'author of the commits created by "toucan setup" '
+            '(default: the user.name and user.email git options)',
+            metavar='"NAME <EMAIL>"')
+
+        self.settings.boolean(
+            ['dry-run'],
+            'only validate the setup file and report what "toucan setup" '
+            'would create, without creating a board')
+
+        self.settings.boolean(
+            ['bare'],
+            'create boards in bare git repositories without a working '
+            'directory')
+
+        self.settings.choice(
+            ['progress'],
+            ['auto', 'text', 'json', 'none'],
+            'how to report the progress of "toucan setup" on stderr: as '
+            'text, as one JSON object per line or not at all (default: '
+            'auto, which is text if stderr is a terminal and none '
+            'otherwise)')
+
+        self.settings.string(
+            ['search-cache'],
+            'cache the search indexes of boards in DIR '
+            '(default: toucan/search in the XDG cache directory)',
+            metavar='DIR')
+
+        self.settings.string(
+            ['history-cache'],
+            'cache the history of boards in DIR '
+            '(default: toucan/history in the XDG cache directory)',
+            metavar='DIR')
+
+        self.settings.string(
+            ['start-lane'],
+            'lane in which work on cards starts when computing metrics '
+            '(default: the second lane of the view with the most lanes)',
+            metavar='LANE')
+
+        self.settings.string(
+            ['done-lane'],
+            'lane in which cards are done when computing metrics '
+            '(default: the last lane of the view with the most lanes)',
+            metavar='LANE')
+
+        self.settings.integer(
+            ['weeks'],
+            'only count throughput and cycle times of the last N weeks '
+            '(default: the whole history of the board)',
+            metavar='N',
+            default=0)
+
+        self.settings.choice(
+            ['format'],
+            ['csv', 'json'],
+            'how to write the data of "toucan cfd" and "toucan burndown": '
+            'as CSV or as JSON (default: csv)')
+
     def cmd_setup(self, args):
         """Set up a new Toucan board from a setup file."""
         if len(args) < 2:
@@ -42,7 +148,7 @@ class Toucan(cliapp.Application):
         """List objects in a Toucan board."""
         if len(args) < 1:
             raise cliapp.AppException(
-                'Usage: toucan list BOARD [PATTERN ...]')
+                'Usage: toucan list BOARD [PATTERN ... | CLASS where QUERY]')
 
         if len(args) == 1:
             args.append('*')
@@ -50,12 +156,67 @@ class Toucan(cliapp.Application):
         cmd = toucanlib.cli.commands.ListCommand(self, args[0], args[1:])
         cmd.run()
 
+    def cmd_search(self, args):
+        """Search the text of cards, comments, lanes and views in a board."""
+        if len(args) < 2:
+            raise cliapp.AppException(
+                'Usage: toucan search BOARD QUERY ...')
+
+        cmd = toucanlib.cli.commands.SearchCommand(
+            self, args[0], ' '.join(args[1:]))
+        cmd.run()
+
+    def cmd_diff(self, args):
+        """Show how objects in a Toucan board changed between commits."""
+        if len(args) != 3:
+            raise cliapp.AppException(
+                'Usage: toucan diff BOARD REVISION1 REVISION2')
+
+        cmd = toucanlib.cli.commands.DiffCommand(
+            self, args[0], args[1], args[2])
+        cmd.run()
+
+    def cmd_log(self, args):
+        """Show how cards in a Toucan board changed over time."""
+        if len(args) < 2:
+            raise cliapp.AppException(
+                'Usage: toucan log BOARD PATTERN ...')
+
+        cmd = toucanlib.cli.commands.LogCommand(self, args[0], args[1:])
+        cmd.run()
+
+    def cmd_metrics(self, args):
+        """Report cycle time, throughput and WIP of a Toucan board."""
+        if len(args) != 1:
+            raise cliapp.AppException('Usage: toucan metrics BOARD')
+
+        cmd = toucanlib.cli.commands.MetricsCommand(self, args[0])
+        cmd.run()
+
+    def cmd_cfd(self, args):
+        """Export the daily card counts per lane of a Toucan board."""
+        if len(args) != 1:
+            raise cliapp.AppException('Usage: toucan cfd BOARD')
+
+        cmd = toucanlib.cli.commands.CumulativeFlowCommand(self, args[0])
+        cmd.run()
+
+    def cmd_burndown(self, args):
+        """Export the daily card counts of a milestone of a Toucan board."""
+        if len(args) != 2:
+            raise cliapp.AppException(
+                'Usage: toucan burndown BOARD MILESTONE')
+
+        cmd = toucanlib.cli.commands.CumulativeFlowCommand(
+            self, args[0], args[1])
+        cmd.run()
+
     def cmd_show(self, args):
         """Show detailed information about objects in a Toucan board."""
         # If there is no board defined then raise an exception
         if len(args) < 1:
             raise cliapp.AppException(
-                'Usage: toucan show BOARD [PATTERN ...]')
+                'Usage: toucan show BOARD [PATTERN ... | CLASS where QUERY]')
 
         board = args[0]
 
@@ -19,13 +19,66 @@
 
 import cliapp
 import consonant
+import csv
+import hashlib
+import json
 import os
 import pygit2
+import re
 import sys
+import time
 
 import toucanlib
 
 
+def _board_cache_dir(cache_dir, name, service_url):
+    # return the directory for cached data of a board, defaulting to
+    # toucan/<name> in the XDG cache directory
+    if not cache_dir:
+        cache_dir = os.path.join(
+            os.environ.get('XDG_CACHE_HOME') or
+            os.path.expanduser(os.path.join('~', '.cache')),
+            'toucan', name)
+
+    # keep the data of different boards apart
+    if os.path.exists(service_url):
+        service_url = os.path.abspath(service_url)
+    return os.path.join(cache_dir, hashlib.sha1(service_url).hexdigest())
+
+
+def _render_changes(output, changes):
+    # render the changes of an object returned by StoreReader.compare()
+    for name, removed, added, is_list in changes:
+        if name in ('created', 'deleted'):
+            output.write('    %s %s\n' % (name, ' '.join(removed + added)))
+        elif is_list:
+            for value in removed:
+                output.write('    %s: -%s\n' % (name, value))
+            for value in added:
+                output.write('    %s: +%s\n' % (name, value))
+        elif removed:
+            output.write('    %s: %s -> %s\n' % (
+                name, removed[0], added[0] if added else '(none)'))
+        else:
+            output.write('    %s: %s\n' % (name, added[0]))
+
+
+def _sort_lanes(lanes, order):
+    # sort lanes in the order of a list of lane UUIDs, followed by
+    # other lanes sorted by name
+    positions = dict((uuid, index) for index, uuid in enumerate(order))
+    lanes.sort(key=lambda lane: (
+        positions.get(lane.uuid, len(positions)), lane['name']))
+
+
+def _parse_timestamp(value):
+    # parse a timestamp property of the form "SECONDS OFFSET"
+    try:
+        return int(str(value).split()[0])
+    except (IndexError, ValueError):
+        return None
+
+
 class SetupCommand(object):
 
     """Command to create a new Toucan board from a setup file."""
@@ -38,10 +91,67 @@ class SetupCommand(object):
 
     def run(self):
         """Perform the board setup."""
+        if self.app.settings['bulk-load'] and self.app.settings['batch-size']:
+            raise cliapp.AppException(
+                'The --bulk-load and --batch-size options cannot be combined')
+        if self.app.settings['update'] and \
+                (self.app.settings['bulk-load'] or
+                 self.app.settings['batch-size']):
+            raise cliapp.AppException(
+                'The --update option cannot be combined with --bulk-load '
+                'or --batch-size')
+        if self.app.settings['update'] and self.app.settings['dry-run']:
+            raise cliapp.AppException(
+                'The --update option cannot be combined with --dry-run')
+
         # parse the setup file
-        parser = toucanlib.cli.setup.SetupParser()
-        setup_file = parser.parse(self.setup_filename,
-                                  open(self.setup_filename, 'r'))
+        if self.app.settings['fail-fast']:
+            max_errors = 1
+        else:
+            max_errors = self.app.settings['max-errors'] or None
+        self.progress_format = self.app.settings['progress']
+        if self.progress_format == 'auto':
+            self.progress_format = 'text' if sys.stderr.isatty() else 'none'
+        if self.progress_format == 'none':
+            progress = None
+        else:
+            progress = toucanlib.cli.setup.SetupProgress(
+                self._report_progress)
+        parser = toucanlib.cli.setup.SetupParser(
+            processes=self.app.settings['processes'] or None,
+            cache_dir=self.app.settings['setup-cache'] or None,
+            max_errors=max_errors,
+            progress=progress)
+        with open(self.setup_filename, 'r') as stream:
+            if self.app.settings['streaming']:
+                setup_file = parser.parse_streaming(
+                    self.setup_filename, stream)
+            else:
+                setup_file = parser.parse(self.setup_filename, stream)
+
+        setup = toucanlib.cli.setup.SetupRunner(
+            batch_size=self.app.settings['batch-size'] or None,
+            progress=progress,
+            bulk_load=self.app.settings['bulk-load'],
+            processes=self.app.settings['processes'] or None,
+            author=self._parse_author(self.app.settings['author']))
+
+        if self.app.settings['dry-run']:
+            self._report_plan(setup.plan(setup_file))
+            return
+
+        if self.app.settings['update']:
+            # open the existing Git repository
+            try:
+                repo = pygit2.Repository(self.target_dir)
+            except KeyError:
+                raise cliapp.AppException(
+                    'Failed to open the board repository: %s' %
+                    self.target_dir)
+
+            # apply the changes to the board
+            setup.run_update(repo, setup_file)
+            return
 
         # create the target directory
         try:
@@ -51,12 +161,74 @@ class SetupCommand(object):
                 'Failed to create the target directory: %s' % e.strerror)
 
         # initialise the Git repository
-        repo = pygit2.init_repository(self.target_dir)
+        repo = pygit2.init_repository(
+            self.target_dir, bare=self.app.settings['bare'])
 
         # perform the actual board setup
-        setup = toucanlib.cli.setup.SetupRunner()
         setup.run(repo, setup_file)
 
+    def _parse_author(self, author):
+        if not author:
+            return None
+        match = re.match(r'^(.+?)\s*<(.+)>$', author)
+        if not match:
+            raise cliapp.AppException(
+                'Author "%s" is not of the form "NAME <EMAIL>"' % author)
+        return pygit2.Signature(match.group(1), match.group(2))
+
+    def _report_plan(self, plan):
+        output = self.app.output
+        output.write('Objects:\n')
+        for klass, count in plan.objects.iteritems():
+            output.write('  %-26s %10d\n' % (klass, count))
+        output.write('  %-26s %10d\n' % ('total', sum(plan.objects.values())))
+        output.write('%-28s %10d\n' % ('References:', plan.references))
+        output.write('%-28s %10d\n' % ('Attachments:', plan.attachments))
+        output.write('%-28s %10s\n' % (
+            'Attachment data:', self._format_size(plan.attachment_bytes)))
+        output.write('%-28s %10d\n' % ('Actions:', plan.actions))
+        output.write('%-28s %10d\n' % ('Commits:', plan.commits))
+        output.write('%-28s %10s\n' % (
+            'Estimated transaction size:',
+            self._format_size(plan.transaction_size)))
+
+    def _format_size(self, size):
+        for unit in ['bytes', 'KiB', 'MiB']:
+            if size < 1024:
+                break
+            size /= 1024.0
+        else:
+            unit = 'GiB'
+        if unit == 'bytes':
+            return '%d %s' % (size, unit)
+        else:
+            return '%.1f %s' % (size, unit)
+
+    def _report_progress(self, event):
+        # progress is reported on stderr, so that it is not mixed with
+        # the output of the command, e.g. the plan of a dry run
+        if self.progress_format == 'json':
+            line = json.dumps(event, sort_keys=True)
+        elif event['event'] == 'message':
+            line = '%s: %s' % (event['stage'], event['message'])
+        elif event['event'] == 'progress':
+            line = '%s: %d%s items' % (
+                event['stage'], event['done'],
+                '/%d' % event['total'] if event['total'] is not None else '')
+            if event['rate'] is not None:
+                line += ', %.0f items/s' % event['rate']
+            if event['eta'] is not None:
+                line += ', %ds remaining' % event['eta']
+        elif event['event'] == 'finish':
+            line = '%s: %d items in %.3fs' % (
+                event['stage'], event['done'], event['elapsed'])
+            if event['rate'] is not None:
+                line += ' (%.0f items/s)' % event['rate']
+        else:
+            return
+        sys.stderr.write('%s\n' % line)
+        sys.stderr.flush()
+
 
 class ListCommand(object):
 
@@ -77,15 +249,409 @@ class ListCommand(object):
         # resolve master into its latest commit
         commit = service.ref('master').head
 
-        # resolve input patterns into objects
+        # resolve input patterns or queries into objects
         resolver = toucanlib.cli.names.NameResolver(service, commit)
-        objects = resolver.resolve_patterns(self.patterns, None)
+        try:
+            objects = resolver.resolve(self.patterns)
+        except toucanlib.cli.names.QueryError, e:
+            raise cliapp.AppException(str(e))
 
         # render objects to the standard output
         renderer = toucanlib.cli.rendering.ListRenderer(service)
         renderer.render(self.app.output, objects)
 
 
+class SearchCommand(object):
+
+    """Command to search the text of objects in a Toucan board."""
+
+    def __init__(self, app, service_url, query):
+        """Initialise a SearchCommand."""
+        self.app = app
+        self.service_url = service_url
+        self.query = query
+
+    def run(self):
+        """Search objects in the Toucan board."""
+        # the search indexes are updated from the git repository of the
+        # board, by comparing the trees of the indexed commits
+        try:
+            repo = pygit2.Repository(self.service_url)
+        except KeyError:
+            raise cliapp.AppException(
+                'Failed to open the board repository: %s' %
+                self.service_url)
+
+        # search the board, reusing the indexes cached for the board
+        searcher = toucanlib.cli.search.Searcher(
+            repo, cache_dir=self._cache_dir())
+        try:
+            commit = searcher.reader.master()
+            objects = searcher.search(commit, self.query)
+        except toucanlib.cli.history.HistoryError, e:
+            raise cliapp.AppException(str(e))
+
+        # render the results to the standard output, best matches first
+        renderer = toucanlib.cli.rendering.ListRenderer(None, ranked=True)
+        renderer.render(self.app.output, objects)
+
+        # if there were no results, inform the user
+        if not objects:
+            self.app.output.write(
+                'No objects found matching "%s".\n' % self.query)
+
+    def _cache_dir(self):
+        return _board_cache_dir(
+            self.app.settings['search-cache'], 'search', self.service_url)
+
+
+class LogCommand(object):
+
+    """Command to show how cards in a Toucan board changed over time."""
+
+    def __init__(self, app, service_url, patterns):
+        """Initialise a LogCommand."""
+        self.app = app
+        self.service_url = service_url
+        self.patterns = patterns
+
+    def run(self):
+        """Show the history of cards in the Toucan board."""
+        # the history is read from the git repository of the board
+        try:
+            repo = pygit2.Repository(self.service_url)
+        except KeyError:
+            raise cliapp.AppException(
+                'Failed to open the board repository: %s' %
+                self.service_url)
+
+        # obtain a Consonant service for the board
+        factory = consonant.service.factories.ServiceFactory()
+        service = factory.service(self.service_url)
+
+        # resolve master into its latest commit
+        commit = service.ref('master').head
+
+        # resolve the input patterns into cards
+        resolver = toucanlib.cli.names.NameResolver(service, commit)
+        cards = [obj for obj in resolver.resolve(self.patterns)
+                 if obj.klass.name == 'card']
+        if not cards:
+            raise cliapp.AppException(
+                'No cards found matching %s' % self.patterns)
+
+        # render the changes made to each card, newest first
+        cache_dir = _board_cache_dir(
+            self.app.settings['history-cache'], 'history', self.service_url)
+        history = toucanlib.cli.history.CardHistory(
+            repo, cache_dir=os.path.join(cache_dir, 'cards'))
+        name_generator = toucanlib.cli.names.NameGenerator()
+        for card in sorted(cards, key=lambda card: card['title']):
+            if len(cards) > 1:
+                self.app.output.write('%s # %s\n\n' % (
+                    name_generator.presentable_name(card), card['title']))
+            try:
+                changes = history.log(card.uuid)
+            except toucanlib.cli.history.HistoryError, e:
+                raise cliapp.AppException(str(e))
+            for change in reversed(changes):
+                self._render_change(change)
+
+    def _render_change(self, change):
+        output = self.app.output
+        output.write('commit %s\n' % change.sha1)
+        output.write('Author: %s <%s>\n' % (change.author, change.email))
+        output.write('Date:   %s\n\n' % self._format_date(
+            change.time, change.offset))
+        _render_changes(output, change.changes)
+        output.write('\n')
+
+    def _format_date(self, timestamp, offset):
+        date = time.gmtime(timestamp + offset * 60)
+        return '%s %s%02d%02d' % (
+            time.strftime('%a %b %d %H:%M:%S %Y', date),
+            '-' if offset < 0 else '+', abs(offset) / 60, abs(offset) % 60)
+
+
+class DiffCommand(object):
+
+    """Command to show how objects changed between two commits."""
+
+    def __init__(self, app, service_url, old_revision, new_revision):
+        """Initialise a DiffCommand."""
+        self.app = app
+        self.service_url = service_url
+        self.old_revision = old_revision
+        self.new_revision = new_revision
+
+    def run(self):
+        """Show the objects that changed between two commits."""
+        # the commits are compared in the git repository of the board
+        try:
+            repo = pygit2.Repository(self.service_url)
+        except KeyError:
+            raise cliapp.AppException(
+                'Failed to open the board repository: %s' %
+                self.service_url)
+
+        reader = toucanlib.cli.history.StoreReader(repo)
+        try:
+            old_commit = reader.commit(self.old_revision)
+            new_commit = reader.commit(self.new_revision)
+            diff = reader.diff(old_commit, new_commit)
+        except toucanlib.cli.history.HistoryError, e:
+            raise cliapp.AppException(str(e))
+
+        # render the changes, grouped by object
+        name_generator = toucanlib.cli.names.NameGenerator()
+        for obj, changes in diff:
+            self.app.output.write(
+                '%s\n' % name_generator.presentable_name(obj))
+            _render_changes(self.app.output, changes)
+
+
+class MetricsCommand(object):
+
+    """Command to report flow metrics of a Toucan board."""
+
+    def __init__(self, app, service_url):
+        """Initialise a MetricsCommand."""
+        self.app = app
+        self.service_url = service_url
+
+    def run(self):
+        """Report cycle time, throughput and WIP per lane and milestone."""
+        # the history is read from the git repository of the board
+        try:
+            repo = pygit2.Repository(self.service_url)
+        except KeyError:
+            raise cliapp.AppException(
+                'Failed to open the board repository: %s' %
+                self.service_url)
+
+        cache_dir = _board_cache_dir(
+            self.app.settings['history-cache'], 'history', self.service_url)
+        history = toucanlib.cli.history.TransitionHistory(
+            repo, cache_dir=cache_dir)
+        reader = history.reader
+        name_generator = toucanlib.cli.names.NameGenerator()
+        try:
+            events = history.events()
+            head = reader.master()
+            lanes = reader.objects(head, 'lane')
+            milestones = reader.objects(head, 'milestone')
+            workflow = toucanlib.cli.metrics.Workflow.from_views(
+                reader.objects(head, 'view'),
+                self.app.settings['start-lane'],
+                self.app.settings['done-lane'],
+                dict((lane.uuid, name_generator.short_names(lane))
+                     for lane in lanes))
+        except (toucanlib.cli.history.HistoryError,
+                toucanlib.cli.metrics.FlowMetricsError), e:
+            raise cliapp.AppException(str(e))
+
+        # metrics are computed up to the latest commit, so that they do
+        # not change while nothing happens on the board
+        now = head.author.time
+        since = None
+        if self.app.settings['weeks']:
+            since = now - self.app.settings['weeks'] * \
+                toucanlib.cli.metrics.WEEK
+        metrics = toucanlib.cli.metrics.FlowMetrics(
+            events, workflow, now, since)
+
+        _sort_lanes(lanes, workflow.lanes)
+        milestones.sort(key=lambda milestone: milestone['short-name'])
+
+        self._report_lanes(lanes, metrics.lanes(), name_generator)
+        self._report_milestones(
+            milestones, metrics.milestones(), name_generator)
+        self._report_totals(metrics)
+
+    def _report_lanes(self, lanes, metrics, name_generator):
+        output = self.app.output
+        output.write('%-24s %5s %8s %6s %16s %10s %10s\n' % (
+            'Lane', 'WIP', 'Entered', 'Left', 'Throughput/week',
+            'Avg time', 'Median'))
+        for lane in lanes:
+            lane_metrics = metrics.get(
+                lane.uuid, toucanlib.cli.metrics.LaneMetrics(lane.uuid))
+            output.write('%-24s %5d %8d %6d %16.1f %10s %10s\n' % (
+                name_generator.presentable_name(lane), lane_metrics.wip,
+                lane_metrics.entered, lane_metrics.left,
+                lane_metrics.throughput,
+                self._format_duration(lane_metrics.average_time),
+                self._format_duration(lane_metrics.median_time)))
+        output.write('\n')
+
+    def _report_milestones(self, milestones, metrics, name_generator):
+        if not milestones:
+            return
+        output = self.app.output
+        output.write('%-24s %5s %5s %5s %16s %10s %10s %10s\n' % (
+            'Milestone', 'Cards', 'Done', 'WIP', 'Throughput/week',
+            'Cycle time', 'Deadline', 'Forecast'))
+        for milestone in milestones:
+            milestone_metrics = metrics.get(
+                milestone.uuid,
+                toucanlib.cli.metrics.MilestoneMetrics(milestone.uuid))
+            output.write('%-24s %5d %5d %5d %16.1f %10s %10s %10s\n' % (
+                name_generator.presentable_name(milestone),
+                milestone_metrics.cards, milestone_metrics.done,
+                milestone_metrics.wip, milestone_metrics.throughput,
+                self._format_duration(milestone_metrics.average_cycle_time),
+                self._format_day(_parse_timestamp(milestone['deadline'])),
+                self._format_day(milestone_metrics.forecast)))
+        output.write('\n')
+
+    def _report_totals(self, metrics):
+        output = self.app.output
+        output.write('Period: %s to %s (%.1f weeks)\n' % (
+            self._format_day(metrics.since), self._format_day(metrics.now),
+            metrics.weeks))
+        output.write('Work in progress: %d cards\n' % metrics.wip())
+        output.write('Throughput: %.1f cards/week\n' % metrics.throughput())
+        output.write('Cycle time: average %s, median %s (%d cards)\n' % (
+            self._format_duration(metrics.average_cycle_time()),
+            self._format_duration(metrics.median_cycle_time()),
+            len(metrics.cycle_times())))
+
+    def _format_duration(self, seconds):
+        if seconds is None:
+            return '-'
+        return '%.1fd' % (seconds / toucanlib.cli.metrics.DAY)
+
+    def _format_day(self, timestamp):
+        if timestamp is None:
+            return '-'
+        return time.strftime('%Y-%m-%d', time.gmtime(timestamp))
+
+
+class CumulativeFlowCommand(object):
+
+    """Command to export daily card counts per lane of a Toucan board.
+
+    Without a milestone, all cards of the board are counted, which is
+    the data of a cumulative flow diagram. With a milestone, only the
+    cards of that milestone are counted, along with the total number
+    of cards and those remaining to be done, for a burndown chart.
+
+    """
+
+    def __init__(self, app, service_url, milestone_name=None):
+        """Initialise a CumulativeFlowCommand."""
+        self.app = app
+        self.service_url = service_url
+        self.milestone_name = milestone_name
+
+    def run(self):
+        """Write the daily card counts as CSV or JSON."""
+        # the history is read from the git repository of the board
+        try:
+            repo = pygit2.Repository(self.service_url)
+        except KeyError:
+            raise cliapp.AppException(
+                'Failed to open the board repository: %s' %
+                self.service_url)
+
+        cache_dir = _board_cache_dir(
+            self.app.settings['history-cache'], 'history', self.service_url)
+        history = toucanlib.cli.history.TransitionHistory(
+            repo, cache_dir=cache_dir)
+        reader = history.reader
+        name_generator = toucanlib.cli.names.NameGenerator()
+        milestone = None
+        workflow = None
+        try:
+            head = reader.master()
+            lanes = reader.objects(head, 'lane')
+            views = reader.objects(head, 'view')
+            if self.milestone_name is not None:
+                milestone = self._find_milestone(
+                    reader.objects(head, 'milestone'), name_generator)
+                workflow = toucanlib.cli.metrics.Workflow.from_views(
+                    views,
+                    self.app.settings['start-lane'],
+                    self.app.settings['done-lane'],
+                    dict((lane.uuid, name_generator.short_names(lane))
+                         for lane in lanes))
+            events = history.events()
+            counts = history.daily_counts(
+                events, milestone.uuid if milestone else None)
+        except (toucanlib.cli.history.HistoryError,
+                toucanlib.cli.metrics.FlowMetricsError), e:
+            raise cliapp.AppException(str(e))
+
+        view = toucanlib.cli.metrics.main_view(views)
+        _sort_lanes(lanes, [reference['uuid'] for reference in view['lanes']]
+                    if view else [])
+        columns = [events.lane_uuids.index(lane.uuid)
+                   if lane.uuid in events.lane_uuids else None
+                   for lane in lanes]
+        done = None
+        if workflow and workflow.lanes[workflow.done] in events.lane_uuids:
+            done = events.lane_uuids.index(workflow.lanes[workflow.done])
+
+        # the series ends on the day of the latest commit, so that it
+        # does not change while nothing happens on the board
+        last_day = int(head.author.time // toucanlib.cli.metrics.DAY)
+        series = counts.series(last_day)
+        if self.app.settings['weeks']:
+            first_day = last_day - 7 * self.app.settings['weeks'] + 1
+            series = [(day, row) for day, row in series if day >= first_day]
+
+        header = ['date']
+        header.extend(name_generator.presentable_name(lane)
+                      for lane in lanes)
+        if milestone is not None:
+            header.extend(['total', 'remaining'])
+
+        rows = []
+        for day, row in series:
+            values = [time.strftime(
+                '%Y-%m-%d', time.gmtime(day * toucanlib.cli.metrics.DAY))]
+            values.extend(self._count(row, column) for column in columns)
+            if milestone is not None:
+                total = sum(row)
+                values.extend([total, total - self._count(row, done)])
+            rows.append(values)
+
+        if self.app.settings['format'] == 'json':
+            self._write_json(header, rows, milestone, name_generator)
+        else:
+            self._write_csv(header, rows)
+
+    def _find_milestone(self, milestones, name_generator):
+        name = self.milestone_name.lower()
+        for milestone in milestones:
+            if name in name_generator.long_names(milestone) or \
+                    name in name_generator.short_names(milestone):
+                return milestone
+        raise cliapp.AppException(
+            'Milestone not found: %s' % self.milestone_name)
+
+    def _count(self, row, column):
+        if column is None or column >= len(row):
+            return 0
+        return row[column]
+
+    def _write_csv(self, header, rows):
+        writer = csv.writer(self.app.output, lineterminator='\n')
+        writer.writerow(header)
+        writer.writerows(rows)
+
+    def _write_json(self, header, rows, milestone, name_generator):
+        data = {
+            'lanes': header[1:len(header) - (2 if milestone else 0)],
+            'days': [dict(zip(header, values)) for values in rows],
+        }
+        if milestone is not None:
+            data['milestone'] = name_generator.presentable_name(milestone)
+        json.dump(data, self.app.output, indent=4, sort_keys=True,
+                  separators=(',', ': '))
+        self.app.output.write('\n')
+
+
 class ShowCommand(object):
 
     """Command to show information about objects in a Toucan board. """
@@ -105,9 +671,12 @@ class ShowCommand(object):
         # Get the latest commit from this service
         commit = service.ref('master').head
 
-        # resolve the input patterns into object
+        # resolve the input patterns or queries into objects
         resolver = toucanlib.cli.names.NameResolver(service, commit)
-        objects = resolver.resolve_patterns(self.patterns, None)
+        try:
+            objects = resolver.resolve(self.patterns)
+        except toucanlib.cli.names.QueryError, e:
+            raise cliapp.AppException(str(e))
 
         # render the objects to stdout
         renderer = toucanlib.cli.rendering.ShowRenderer(service, commit)
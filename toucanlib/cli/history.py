@@ -0,0 +1,800 @@
+# Copyright (C) 2014 Codethink Limited.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Read the history of objects from the git repositories of boards."""
+
+
+import array
+import collections
+import cPickle
+import logging
+import os
+import pygit2
+import tempfile
+import yaml
+
+import toucanlib
+
+try:
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeLoader
+
+
+class HistoryError(Exception):
+
+    """Errors occuring while reading the history of a board."""
+
+    pass
+
+
+class StoreClass(object):
+
+    """The class of an object read from a board repository."""
+
+    def __init__(self, name):
+        """Initialise a StoreClass."""
+        self.name = name
+
+
+class StoreProperty(object):
+
+    """A property of an object read from a board repository."""
+
+    def __init__(self, name, value):
+        """Initialise a StoreProperty."""
+        self.name = name
+        self.value = value
+
+
+class StoreObject(object):
+
+    """An object read from a board repository at a specific commit.
+
+    Store objects mimic Consonant objects closely enough to generate
+    their names with a NameGenerator. References are kept as the
+    {'uuid': ...} dicts stored in the repository, lists as plain lists.
+
+    """
+
+    def __init__(self, uuid, klass, properties):
+        """Initialise a StoreObject."""
+        self.uuid = uuid
+        self.klass = klass
+        self.properties = properties
+
+    def __getitem__(self, name):
+        """Return the value of the property with the given name."""
+        return self.properties[name].value
+
+    def __contains__(self, name):
+        """Return whether the object has a property with the given name."""
+        return name in self.properties
+
+
+class StoreReader(object):
+
+    """Read objects from the commits of a board repository.
+
+    Objects are stored as <class>/<uuid>/properties.yaml in the trees of
+    commits. Since blobs are immutable, parsed objects are cached by the
+    ID of their properties blob and shared between commits. Objects with
+    identical properties share a blob, so the cache is keyed by the
+    class and UUID of objects as well. Only the most recently used
+    objects are kept, up to the given maximum.
+
+    """
+
+    def __init__(self, repo, max_cached=1000):
+        """Initialise a StoreReader for a pygit2 repository."""
+        self.repo = repo
+        self.max_cached = max_cached
+        self.name_generator = toucanlib.cli.names.NameGenerator()
+        self._objects = collections.OrderedDict()
+
+    def master(self):
+        """Return the latest commit in the master branch."""
+        try:
+            ref = self.repo.lookup_reference('refs/heads/master')
+        except KeyError:
+            raise HistoryError(
+                'The board repository %s has no master branch' %
+                self.repo.path)
+        return self.repo[ref.target]
+
+    def commit(self, revision):
+        """Return the commit a revision such as a SHA1 or tag refers to."""
+        try:
+            obj = self.repo.revparse_single(revision)
+        except (KeyError, ValueError):
+            raise HistoryError('Unknown revision: %s' % revision)
+        if obj.type == pygit2.GIT_OBJ_TAG:
+            obj = self.repo[obj.target]
+        if obj.type != pygit2.GIT_OBJ_COMMIT:
+            raise HistoryError('Revision %s is not a commit' % revision)
+        return obj
+
+    def diff(self, old_commit, new_commit):
+        """Return the objects that differ between two commits.
+
+        Returns a list of (object, changes) tuples, where the object is
+        taken from the new commit, or from the old one if it was
+        deleted, and the changes are those returned by compare(). Like
+        git's tree diff, the trees of both commits are compared by the
+        IDs of their entries, level by level, so only the trees of
+        changed classes are listed and only changed objects are loaded.
+
+        """
+        result = []
+        old_classes = self._tree_entries(old_commit.tree)
+        new_classes = self._tree_entries(new_commit.tree)
+        for class_name in sorted(set(old_classes) | set(new_classes)):
+            old_class = old_classes.get(class_name)
+            new_class = new_classes.get(class_name)
+            if old_class == new_class:
+                continue
+            old_objects = self._tree_entries(old_class)
+            new_objects = self._tree_entries(new_class)
+            for uuid in sorted(set(old_objects) | set(new_objects)):
+                if old_objects.get(uuid) == new_objects.get(uuid):
+                    continue
+                old_files = self._tree_entries(old_objects.get(uuid))
+                new_files = self._tree_entries(new_objects.get(uuid))
+                old_id = old_files.get('properties.yaml')
+                new_id = new_files.get('properties.yaml')
+                changes = self.compare(
+                    class_name, uuid, old_commit, old_id, new_commit, new_id)
+
+                # raw properties are stored in separate files, report
+                # changed data even if its content type did not change
+                if old_id is not None and new_id is not None:
+                    reported = set(change[0] for change in changes)
+                    for name in sorted(set(old_files) | set(new_files)):
+                        if name == 'properties.yaml' or name in reported:
+                            continue
+                        if old_files.get(name) != new_files.get(name):
+                            changes.append(
+                                (name, [], ['(data changed)'], False))
+
+                obj = self.load_blob(new_id or old_id, class_name, uuid)
+                result.append((obj, changes))
+        return result
+
+    def objects(self, commit, class_name):
+        """Return all objects of a class in a commit.
+
+        This loads every object of the class, so it is meant for classes
+        with few objects, such as lanes, views and milestones.
+
+        """
+        class_tree = self._tree_entries(commit.tree).get(class_name)
+        result = []
+        for uuid, tree in sorted(self._tree_entries(class_tree).iteritems()):
+            oid = self._tree_entries(tree).get('properties.yaml')
+            if oid is not None:
+                result.append(self.load_blob(oid, class_name, uuid))
+        return result
+
+    def changed_objects(self, old_commit, new_commit, class_name):
+        """Return the objects of a class that differ between two commits.
+
+        Returns a list of (uuid, old_id, new_id) tuples with the IDs of
+        the properties blobs of the objects, which are None if an object
+        does not exist in a commit. The old commit may be None, in which
+        case all objects of the new commit are returned.
+
+        """
+        if old_commit is None:
+            old_class = None
+        else:
+            old_class = self._tree_entries(old_commit.tree).get(class_name)
+        new_class = self._tree_entries(new_commit.tree).get(class_name)
+        if old_class == new_class:
+            return []
+
+        result = []
+        old_objects = self._tree_entries(old_class)
+        new_objects = self._tree_entries(new_class)
+        for uuid in sorted(set(old_objects) | set(new_objects)):
+            if old_objects.get(uuid) != new_objects.get(uuid):
+                old_files = self._tree_entries(old_objects.get(uuid))
+                new_files = self._tree_entries(new_objects.get(uuid))
+                result.append((uuid, old_files.get('properties.yaml'),
+                               new_files.get('properties.yaml')))
+        return result
+
+    def _tree_entries(self, tree):
+        # return the IDs of the entries in a tree by name, accepting a
+        # tree or the ID of a tree, which may be None for missing trees
+        if tree is None:
+            return {}
+        if not isinstance(tree, pygit2.Tree):
+            tree = self.repo[tree]
+            if not isinstance(tree, pygit2.Tree):
+                return {}
+        return dict((entry.name, entry.oid) for entry in tree)
+
+    def object_id(self, commit, class_name, uuid):
+        """Return the ID of an object's properties blob in a commit.
+
+        Returns None if the object does not exist in the commit. Only
+        the trees along the path of the object are read, so this is a
+        cheap way to find out whether an object changed in a commit.
+
+        """
+        try:
+            return commit.tree['%s/%s/properties.yaml' %
+                               (class_name, uuid)].oid
+        except KeyError:
+            return None
+
+    def load_object(self, commit, class_name, uuid):
+        """Return an object in a commit or None if it does not exist."""
+        oid = self.object_id(commit, class_name, uuid)
+        if oid is None:
+            return None
+        return self.load_blob(oid, class_name, uuid)
+
+    def load_blob(self, oid, class_name, uuid, cached=True):
+        """Return the object stored in a properties blob.
+
+        Objects that are only needed once, e.g. when reading each version
+        of every object in the history of a board, can be loaded without
+        adding them to the cache by passing cached=False.
+
+        """
+        key = (oid, class_name, uuid)
+        obj = self._objects.pop(key, None)
+        if obj is None:
+            data = yaml.load(self.repo[oid].data, Loader=SafeLoader) or {}
+            properties = dict(
+                (name, StoreProperty(name, value))
+                for name, value in data.iteritems())
+            obj = StoreObject(uuid, StoreClass(class_name), properties)
+            if not cached:
+                return obj
+
+        # re-insert the object to mark it as the most recently used one
+        # and drop the least recently used objects
+        self._objects[key] = obj
+        while len(self._objects) > self.max_cached:
+            self._objects.popitem(last=False)
+        return obj
+
+    def compare(self, class_name, uuid, old_commit, old_id, new_commit,
+                new_id):
+        """Return the changes of an object between two commits.
+
+        The object is given by the IDs of its properties blobs in the
+        old and new commit, either of which may be None if the object
+        does not exist in that commit. Changes are returned as a list of
+        (property, removed, added, is_list) tuples, where removed and
+        added are lists of values described as text. Lists only report
+        the elements that were removed or added. Objects that were
+        created have a leading "created" change, objects that were
+        deleted only have a "deleted" change.
+
+        """
+        if new_id is None:
+            old_obj = self.load_blob(old_id, class_name, uuid)
+            return [('deleted', [self.name_generator.presentable_name(
+                old_obj)], [], False)]
+
+        changes = []
+        new_obj = self.load_blob(new_id, class_name, uuid)
+        new = new_obj.properties
+        if old_id is None:
+            changes.append(
+                ('created', [], [self.name_generator.presentable_name(
+                    new_obj)], False))
+            old = {}
+        else:
+            old = self.load_blob(old_id, class_name, uuid).properties
+
+        for name in sorted(set(old) | set(new)):
+            old_value = old[name].value if name in old else None
+            new_value = new[name].value if name in new else None
+            if old_value == new_value:
+                continue
+            removed = self._values(
+                old_commit, class_name, name, old_value)
+            added = self._values(
+                new_commit, class_name, name, new_value)
+            is_list = isinstance(old_value, list) or \
+                isinstance(new_value, list)
+            if is_list:
+                # only report the elements that were added or removed
+                removed, added = \
+                    [x for x in removed if x not in added], \
+                    [x for x in added if x not in removed]
+            changes.append((name, removed, added, is_list))
+
+        return changes
+
+    def _values(self, commit, class_name, name, value):
+        if value is None:
+            return []
+        elif isinstance(value, list):
+            return [self._value(commit, class_name, name, x) for x in value]
+        else:
+            return [self._value(commit, class_name, name, value)]
+
+    def _value(self, commit, class_name, name, value):
+        # describe a property value, referenced objects by their names
+        # in the commit and raw properties by their content type
+        if isinstance(value, dict) and 'content-type' in value:
+            return '(%s data)' % value['content-type']
+        elif isinstance(value, dict) and 'uuid' in value:
+            target_class = toucanlib.cli.names.REFERENCE_PROPERTIES.get(
+                class_name, {}).get(name)
+            obj = None
+            if target_class and commit is not None:
+                obj = self.load_object(commit, target_class, value['uuid'])
+            if obj is None:
+                return value['uuid']
+            label = self.name_generator.presentable_name(obj)
+            if target_class == 'comment':
+                label = '%s %s' % (label, ' '.join(obj['comment'].split()))
+            return label
+        elif isinstance(value, basestring):
+            return ' '.join(value.split())
+        else:
+            return str(value)
+
+
+class CardChange(object):
+
+    """The changes made to a card in a single commit.
+
+    Changes are (property, removed, added, is_list) tuples, where
+    removed and added are lists of values. Referenced objects are
+    represented by their names at the time of the commit, so that
+    changes can be displayed and cached without reading the repository
+    again.
+
+    """
+
+    def __init__(self, sha1, author, email, time, offset, changes):
+        """Initialise a CardChange."""
+        self.sha1 = sha1
+        self.author = author
+        self.email = email
+        self.time = time
+        self.offset = offset
+        self.changes = changes
+
+
+class CardHistory(object):
+
+    """Compute how cards changed over the history of a board.
+
+    The master branch is walked along its first parents and each commit
+    is compared with its parent by the ID of the card's properties blob,
+    so commits that do not touch the card are skipped without parsing
+    anything. The changes found are cached per card along with the
+    commit they were computed for, so later calls only walk the commits
+    added to master since.
+
+    """
+
+    def __init__(self, repo, cache_dir=None):
+        """Initialise a CardHistory for a pygit2 repository."""
+        self.reader = StoreReader(repo)
+        self.repo = repo
+        self.cache_dir = cache_dir
+
+    def log(self, uuid):
+        """Return the changes made to a card, oldest first."""
+        head = self.reader.master()
+
+        cached = self._load_cached(uuid)
+        if cached is not None:
+            cached_sha1, cached_changes = cached
+            if cached_sha1 == head.hex:
+                return cached_changes
+            if not self._descendant_of(head.oid, cached_sha1):
+                # master has been rewritten, start from scratch
+                cached = None
+
+        walker = self.repo.walk(head.oid, pygit2.GIT_SORT_TOPOLOGICAL)
+        walker.simplify_first_parent()
+        if cached is not None:
+            walker.hide(pygit2.Oid(hex=cached_sha1))
+
+        changes = []
+        for commit in walker:
+            change = self._commit_change(commit, uuid)
+            if change is not None:
+                changes.append(change)
+                if change.changes[0][0] == 'created':
+                    # the card does not exist before it was created
+                    break
+        changes.reverse()
+
+        if cached is not None:
+            changes = cached_changes + changes
+        self._store_cached(uuid, head.hex, changes)
+        return changes
+
+    def _descendant_of(self, oid, sha1):
+        try:
+            return self.repo.descendant_of(oid, pygit2.Oid(hex=sha1))
+        except (KeyError, ValueError):
+            return False
+
+    def _commit_change(self, commit, uuid):
+        new_id = self.reader.object_id(commit, 'card', uuid)
+        if commit.parents:
+            parent = commit.parents[0]
+            old_id = self.reader.object_id(parent, 'card', uuid)
+        else:
+            parent = None
+            old_id = None
+        if new_id == old_id:
+            return None
+
+        changes = self.reader.compare(
+            'card', uuid, parent, old_id, commit, new_id)
+        return CardChange(commit.hex, commit.author.name, commit.author.email,
+                          commit.author.time, commit.author.offset, changes)
+
+    def _cache_path(self, uuid):
+        return os.path.join(self.cache_dir, uuid)
+
+    def _load_cached(self, uuid):
+        if not self.cache_dir:
+            return None
+        return _load_cache(self._cache_path(uuid), 'card history')
+
+    def _store_cached(self, uuid, sha1, changes):
+        if self.cache_dir:
+            _store_cache(self._cache_path(uuid), (sha1, changes))
+
+
+class TransitionEvents(object):
+
+    """The lane transitions of the cards of a board.
+
+    Events are stored in parallel arrays, one row per event, so that
+    they can be aggregated column by column and pickled compactly.
+    Cards, lanes and milestones are stored as indexes into the lists
+    of their UUIDs, with -1 standing for no lane or milestone, e.g.
+    for the source lane of a card that has just been created.
+
+    Columns:
+        times      -- the time of the event, in seconds since the epoch
+        cards      -- the card that moved
+        sources    -- the lane the card left
+        targets    -- the lane the card entered
+        entered    -- the time the card entered the source lane
+        milestones -- the milestone of the card at the time
+
+    Events are also recorded when only the milestone of a card changes,
+    in which case the source and target lanes are the same.
+
+    """
+
+    def __init__(self):
+        """Initialise an empty TransitionEvents table."""
+        self.sha1 = None
+        self.card_uuids = []
+        self.lane_uuids = []
+        self.milestone_uuids = []
+        self.times = array.array('d')
+        self.cards = array.array('l')
+        self.sources = array.array('l')
+        self.targets = array.array('l')
+        self.entered = array.array('d')
+        self.milestones = array.array('l')
+
+        # the latest lane, entry time and milestone of each card
+        self.states = {}
+
+        # the indexes of UUIDs in the lists above
+        self._indexes = {}
+
+    def __len__(self):
+        """Return the number of events."""
+        return len(self.times)
+
+    def record(self, time, card_uuid, lane_uuid, milestone_uuid):
+        """Record the lane and milestone of a card at a point in time.
+
+        An event is only added if the lane or milestone of the card has
+        changed since it was last recorded. A lane of None means that
+        the card was deleted.
+
+        """
+        card = self._index(self.card_uuids, card_uuid)
+        lane = self._index(self.lane_uuids, lane_uuid)
+        milestone = self._index(self.milestone_uuids, milestone_uuid)
+
+        source, entered, old_milestone = \
+            self.states.get(card, (-1, time, -1))
+        if source == lane and old_milestone == milestone:
+            return
+
+        self.times.append(time)
+        self.cards.append(card)
+        self.sources.append(source)
+        self.targets.append(lane)
+        self.entered.append(entered)
+        self.milestones.append(milestone)
+
+        if lane == -1:
+            del self.states[card]
+        elif lane == source:
+            self.states[card] = (lane, entered, milestone)
+        else:
+            self.states[card] = (lane, time, milestone)
+
+    def _index(self, uuids, uuid):
+        if uuid is None:
+            return -1
+        indexes = self._indexes.setdefault(id(uuids), {})
+        if uuid not in indexes:
+            indexes[uuid] = len(uuids)
+            uuids.append(uuid)
+        return indexes[uuid]
+
+    def __getstate__(self):
+        """Return the state of the table for pickling."""
+        state = dict(self.__dict__)
+        del state['_indexes']
+        return state
+
+    def __setstate__(self, state):
+        """Restore the state of a pickled table."""
+        self.__dict__.update(state)
+        self._indexes = {}
+        for uuids in (self.card_uuids, self.lane_uuids,
+                      self.milestone_uuids):
+            self._indexes[id(uuids)] = dict(
+                (uuid, index) for index, uuid in enumerate(uuids))
+
+
+class DailyCounts(object):
+
+    """The number of cards in each lane at the end of every day.
+
+    Counts are derived from a TransitionEvents table and kept as one
+    row per day, starting at the day of the first event, with one
+    column per lane in the order of the lane UUIDs of the events. The
+    number of events that have been counted is remembered, so that the
+    counts can be brought up to date with events added to the table
+    later. Days are UTC days, numbered since the epoch.
+
+    If a milestone UUID is given, only cards of that milestone are
+    counted.
+
+    """
+
+    def __init__(self, milestone_uuid=None):
+        """Initialise empty DailyCounts."""
+        self.sha1 = None
+        self.milestone_uuid = milestone_uuid
+        self.position = 0
+        self.first_day = None
+        self.rows = []
+
+        # the lanes of the cards that are currently counted
+        self._lanes = {}
+
+    def update(self, events):
+        """Count the events added to a table since the last update."""
+        milestone = -2
+        if self.milestone_uuid in events.milestone_uuids:
+            milestone = events.milestone_uuids.index(self.milestone_uuid)
+
+        for index in xrange(self.position, len(events)):
+            row = self._row(int(events.times[index] // 86400))
+            card = events.cards[index]
+            lane = self._lanes.pop(card, -1)
+            if lane >= 0:
+                row[lane] -= 1
+            target = events.targets[index]
+            if target >= 0 and (self.milestone_uuid is None or
+                                events.milestones[index] == milestone):
+                if target >= len(row):
+                    row.extend([0] * (target + 1 - len(row)))
+                row[target] += 1
+                self._lanes[card] = target
+
+        self.position = len(events)
+        self.sha1 = events.sha1
+
+    def series(self, last_day):
+        """Return (day, counts) tuples for all days up to a given day."""
+        if self.first_day is None:
+            return []
+        series = [(self.first_day + offset, row)
+                  for offset, row in enumerate(self.rows)]
+        day, row = series[-1]
+        for day in xrange(day + 1, last_day + 1):
+            series.append((day, row))
+        return series
+
+    def _row(self, day):
+        # return the row of a day, adding rows for the days since the
+        # last event. events may be slightly out of order, in which
+        # case they are counted on the day of the latest event
+        if self.first_day is None:
+            self.first_day = day
+            self.rows.append(array.array('l'))
+        for day in xrange(self.first_day + len(self.rows), day + 1):
+            self.rows.append(array.array('l', self.rows[-1]))
+        return self.rows[-1]
+
+
+class TransitionHistory(object):
+
+    """Derive the lane transitions of cards from the history of a board.
+
+    The master branch is walked along its first parents. For each commit,
+    the cards that changed are found by comparing the card tree with the
+    one of the parent commit, and their lane and milestone references
+    are recorded in a TransitionEvents table. The table is cached along
+    with the commit it was computed for, so that later calls only walk
+    and extract the commits added to master since.
+
+    """
+
+    def __init__(self, repo, cache_dir=None):
+        """Initialise a TransitionHistory for a pygit2 repository."""
+        self.reader = StoreReader(repo)
+        self.repo = repo
+        self.cache_dir = cache_dir
+
+    def events(self):
+        """Return the lane transitions up to the latest master commit."""
+        head = self.reader.master()
+
+        events = self._load_cached()
+        if events is not None:
+            if events.sha1 == head.hex:
+                return events
+            if not self._descendant_of(head.oid, events.sha1):
+                # master has been rewritten, start from scratch
+                events = None
+        if events is None:
+            events = TransitionEvents()
+
+        walker = self.repo.walk(head.oid, pygit2.GIT_SORT_TOPOLOGICAL)
+        walker.simplify_first_parent()
+        if events.sha1 is not None:
+            walker.hide(pygit2.Oid(hex=events.sha1))
+
+        # the walk starts at the head, but events need to be recorded
+        # in the order in which they happened
+        commits = list(walker)
+        commits.reverse()
+        for commit in commits:
+            self._record_commit(events, commit)
+        events.sha1 = head.hex
+
+        self._store_cached(events)
+        return events
+
+    def daily_counts(self, events, milestone_uuid=None):
+        """Return the daily card counts per lane for a table of events.
+
+        The events must have been returned by events(). The counts are
+        cached separately for the whole board and for each milestone,
+        and updated with the events of new commits.
+
+        """
+        counts = self._load_cached_counts(milestone_uuid)
+        if counts is not None and counts.sha1 != events.sha1:
+            if not self._descendant_of(
+                    pygit2.Oid(hex=events.sha1), counts.sha1):
+                counts = None
+        if counts is None:
+            counts = DailyCounts(milestone_uuid)
+
+        if counts.sha1 != events.sha1:
+            counts.update(events)
+            self._store_cached_counts(counts)
+        return counts
+
+    def _record_commit(self, events, commit):
+        parent = commit.parents[0] if commit.parents else None
+        changed = self.reader.changed_objects(parent, commit, 'card')
+        for uuid, old_id, new_id in changed:
+            if new_id is None:
+                events.record(commit.author.time, uuid, None, None)
+            elif new_id != old_id:
+                card = self.reader.load_blob(
+                    new_id, 'card', uuid, cached=False)
+                events.record(commit.author.time, uuid,
+                              self._reference(card, 'lane'),
+                              self._reference(card, 'milestone'))
+
+    def _reference(self, card, name):
+        if name in card and isinstance(card[name], dict):
+            return card[name].get('uuid')
+        return None
+
+    def _descendant_of(self, oid, sha1):
+        try:
+            return self.repo.descendant_of(oid, pygit2.Oid(hex=sha1))
+        except (KeyError, ValueError):
+            return False
+
+    def _cache_path(self):
+        return os.path.join(self.cache_dir, 'transitions')
+
+    def _load_cached(self):
+        if not self.cache_dir:
+            return None
+        cached = _load_cache(self._cache_path(), 'lane transition')
+        if cached is None:
+            return None
+        return cached[0]
+
+    def _store_cached(self, events):
+        if self.cache_dir:
+            _store_cache(self._cache_path(), (events,))
+
+    def _counts_cache_path(self, milestone_uuid):
+        if milestone_uuid is None:
+            return os.path.join(self.cache_dir, 'cfd')
+        else:
+            return os.path.join(self.cache_dir, 'burndown-%s' % milestone_uuid)
+
+    def _load_cached_counts(self, milestone_uuid):
+        if not self.cache_dir:
+            return None
+        cached = _load_cache(
+            self._counts_cache_path(milestone_uuid), 'daily counts')
+        if cached is None:
+            return None
+        return cached[0]
+
+    def _store_cached_counts(self, counts):
+        if self.cache_dir:
+            _store_cache(
+                self._counts_cache_path(counts.milestone_uuid), (counts,))
+
+
+def _load_cache(path, description):
+    # load the data stored by _store_cache(), unless it does not exist
+    # or was stored by a different version of Toucan
+    try:
+        with open(path, 'rb') as stream:
+            data = cPickle.load(stream)
+        if data[0] != toucanlib.__version__:
+            return None
+        return data[1:]
+    except IOError:
+        return None
+    except Exception, e:
+        logging.warning('Ignoring invalid %s cache %s: %s' %
+                        (description, path, e))
+        return None
+
+
+def _store_cache(path, data):
+    cache_dir = os.path.dirname(path)
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+
+    # write the cache entry to a temporary file first, so that other
+    # processes never see incomplete entries
+    handle, temp_path = tempfile.mkstemp(dir=cache_dir)
+    with os.fdopen(handle, 'wb') as stream:
+        cPickle.dump((toucanlib.__version__,) + tuple(data), stream,
+                     cPickle.HIGHEST_PROTOCOL)
+    os.rename(temp_path, path)
@@ -0,0 +1,324 @@
+# Copyright (C) 2014 Codethink Limited.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Compute flow metrics from the lane transitions of cards."""
+
+
+import array
+import itertools
+
+
+DAY = 86400.0
+WEEK = 7 * DAY
+
+
+class FlowMetricsError(Exception):
+
+    """Errors occuring while computing flow metrics."""
+
+    pass
+
+
+def main_view(views):
+    """Return the view with the most lanes, or None if there is none."""
+    views = [view for view in views if 'lanes' in view]
+    if not views:
+        return None
+    return max(views, key=lambda view: (len(view['lanes']), view.uuid))
+
+
+class Workflow(object):
+
+    """The ordered lanes that cards flow through on a board.
+
+    Cards are in progress from the time they enter the start lane or
+    any later lane, until they enter the done lane. Lanes before the
+    start lane, e.g. a backlog, and lanes outside the workflow do not
+    count as work in progress.
+
+    """
+
+    def __init__(self, lanes, start_lane, done_lane):
+        """Initialise a Workflow from a list of lane UUIDs."""
+        self.lanes = lanes
+        self.start = lanes.index(start_lane)
+        self.done = lanes.index(done_lane)
+        if self.start >= self.done:
+            raise FlowMetricsError(
+                'The start lane must come before the done lane')
+
+    @staticmethod
+    def from_views(views, start_name=None, done_name=None, names=None):
+        """Return the workflow of the view with the most lanes.
+
+        By default, cards start in the second lane of the view and are
+        done in its last lane. Other lanes of the view can be chosen by
+        name, in which case a names dict mapping lane UUIDs to lists of
+        lane names must be given.
+
+        """
+        view = main_view(views)
+        if view is None:
+            raise FlowMetricsError('The board has no view with lanes')
+        lanes = [reference['uuid'] for reference in view['lanes']]
+        if len(lanes) < 2:
+            raise FlowMetricsError(
+                'The view %s has less than two lanes' % view['name'])
+
+        start_lane = Workflow._find_lane(
+            lanes, start_name, names, lanes[1], view)
+        done_lane = Workflow._find_lane(
+            lanes, done_name, names, lanes[-1], view)
+        return Workflow(lanes, start_lane, done_lane)
+
+    @staticmethod
+    def _find_lane(lanes, name, names, default, view):
+        if not name:
+            return default
+        for lane in lanes:
+            if name.lower() in names.get(lane, ()):
+                return lane
+        raise FlowMetricsError(
+            'The view %s has no lane %s' % (view['name'], name))
+
+
+class LaneMetrics(object):
+
+    """Flow metrics of a single lane."""
+
+    def __init__(self, uuid):
+        """Initialise empty LaneMetrics."""
+        self.uuid = uuid
+
+        # Number of cards currently in the lane.
+        self.wip = 0
+
+        # Number of cards that entered and left the lane in the period.
+        self.entered = 0
+        self.left = 0
+
+        # Cards leaving the lane per week.
+        self.throughput = 0.0
+
+        # Mean and median time cards spent in the lane before leaving
+        # it, in seconds, or None if no card left the lane.
+        self.average_time = None
+        self.median_time = None
+
+
+class MilestoneMetrics(object):
+
+    """Flow metrics of the cards of a milestone."""
+
+    def __init__(self, uuid):
+        """Initialise empty MilestoneMetrics."""
+        self.uuid = uuid
+
+        # Number of cards in the milestone, done and in progress.
+        self.cards = 0
+        self.done = 0
+        self.wip = 0
+
+        # Cards of the milestone completed per week.
+        self.throughput = 0.0
+
+        # Mean and median cycle time of completed cards in seconds.
+        self.average_cycle_time = None
+        self.median_cycle_time = None
+
+        # Time at which the remaining cards are expected to be done at
+        # the current throughput, or None if nothing is being completed.
+        self.forecast = None
+
+
+class FlowMetrics(object):
+
+    """Compute cycle time, throughput and work in progress.
+
+    Metrics are computed from a TransitionEvents table over a period
+    that ends now and starts at a given time, by default the first
+    event. Throughput is counted per week of that period and cycle
+    times are those of the cards completed in it. Work in progress is
+    always that of the latest state of the board.
+
+    The aggregates are computed over the columns of the event table.
+    A lane position column is derived once, after which each metric
+    is a single pass over the columns it needs.
+
+    """
+
+    def __init__(self, events, workflow, now, since=None):
+        """Initialise FlowMetrics for a table of events."""
+        self.events = events
+        self.workflow = workflow
+        self.now = now
+        if since is None:
+            since = events.times[0] if len(events) else now
+        self.since = since
+        self.weeks = max(now - since, DAY) / WEEK
+
+        # the workflow position of each lane in the events table, with
+        # -1 for lanes outside the workflow and for no lane at all
+        positions = dict(
+            (uuid, index) for index, uuid in enumerate(workflow.lanes))
+        self._lane_positions = array.array(
+            'l', [positions.get(uuid, -1) for uuid in events.lane_uuids])
+        self._positions = array.array(
+            'l', [self._lane_positions[lane] if lane >= 0 else -1
+                  for lane in events.targets])
+
+        self._completions = self._completion_events()
+        self._cycle_times = self._card_cycle_times()
+
+    def lanes(self):
+        """Return the metrics of all lanes in the events, by UUID."""
+        events = self.events
+        metrics = [LaneMetrics(uuid) for uuid in events.lane_uuids]
+
+        for lane, entered, milestone in events.states.itervalues():
+            metrics[lane].wip += 1
+
+        times_in_lane = [array.array('d') for uuid in events.lane_uuids]
+        for time, source, target, entered in itertools.izip(
+                events.times, events.sources, events.targets,
+                events.entered):
+            if source == target or time < self.since:
+                continue
+            if target >= 0:
+                metrics[target].entered += 1
+            if source >= 0:
+                metrics[source].left += 1
+                times_in_lane[source].append(time - entered)
+
+        for lane_metrics, times in itertools.izip(metrics, times_in_lane):
+            lane_metrics.throughput = lane_metrics.left / self.weeks
+            lane_metrics.average_time = _mean(times)
+            lane_metrics.median_time = _median(times)
+
+        return dict((lane_metrics.uuid, lane_metrics)
+                    for lane_metrics in metrics)
+
+    def milestones(self):
+        """Return the metrics of all milestones in the events, by UUID."""
+        events = self.events
+        metrics = [MilestoneMetrics(uuid) for uuid in events.milestone_uuids]
+
+        cycle_times = [array.array('d') for uuid in events.milestone_uuids]
+        for card, (lane, entered, milestone) in events.states.iteritems():
+            if milestone < 0:
+                continue
+            metrics[milestone].cards += 1
+            position = self._lane_positions[lane]
+            if position == self.workflow.done:
+                metrics[milestone].done += 1
+            elif self.workflow.start <= position < self.workflow.done:
+                metrics[milestone].wip += 1
+            if card in self._cycle_times:
+                cycle_times[milestone].append(self._cycle_times[card])
+
+        for index in self._completions:
+            milestone = events.milestones[index]
+            if milestone >= 0:
+                metrics[milestone].throughput += 1
+
+        for milestone_metrics, times in itertools.izip(metrics, cycle_times):
+            milestone_metrics.throughput /= self.weeks
+            milestone_metrics.average_cycle_time = _mean(times)
+            milestone_metrics.median_cycle_time = _median(times)
+            remaining = milestone_metrics.cards - milestone_metrics.done
+            if remaining == 0:
+                milestone_metrics.forecast = self.now
+            elif milestone_metrics.throughput > 0:
+                milestone_metrics.forecast = self.now + \
+                    remaining / milestone_metrics.throughput * WEEK
+
+        return dict((milestone_metrics.uuid, milestone_metrics)
+                    for milestone_metrics in metrics)
+
+    def cycle_times(self):
+        """Return the cycle times of the cards completed in the period."""
+        return array.array('d', sorted(self._cycle_times.itervalues()))
+
+    def average_cycle_time(self):
+        """Return the mean cycle time in seconds, or None if there is none."""
+        return _mean(self._cycle_times.values())
+
+    def median_cycle_time(self):
+        """Return the median cycle time in seconds, or None."""
+        return _median(self._cycle_times.values())
+
+    def throughput(self):
+        """Return the number of cards completed per week."""
+        return len(self._completions) / self.weeks
+
+    def wip(self):
+        """Return the number of cards currently in progress."""
+        wip = 0
+        for lane, entered, milestone in self.events.states.itervalues():
+            position = self._lane_positions[lane]
+            if self.workflow.start <= position < self.workflow.done:
+                wip += 1
+        return wip
+
+    def _completion_events(self):
+        # return the indexes of events in the period in which a card
+        # moved into the done lane from another lane
+        done = self.workflow.done
+        events = self.events
+        return [index for index, (time, source, target, position) in
+                enumerate(itertools.izip(events.times, events.sources,
+                                         events.targets, self._positions))
+                if position == done and source != target and source >= 0
+                and time >= self.since]
+
+    def _card_cycle_times(self):
+        # cards start when they first enter a lane in progress and are
+        # completed when they last enter the done lane. only cards that
+        # are still done and were completed in the period are counted
+        events = self.events
+        started = {}
+        finished = {}
+        for time, card, position in itertools.izip(
+                events.times, events.cards, self._positions):
+            if self.workflow.start <= position < self.workflow.done:
+                started.setdefault(card, time)
+            elif position == self.workflow.done:
+                finished[card] = time
+
+        cycle_times = {}
+        for card, time in finished.iteritems():
+            state = events.states.get(card)
+            if card in started and state and time >= self.since and \
+                    self._lane_positions[state[0]] == self.workflow.done:
+                cycle_times[card] = time - started[card]
+        return cycle_times
+
+
+def _mean(values):
+    if not values:
+        return None
+    return sum(values) / len(values)
+
+
+def _median(values):
+    if not values:
+        return None
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+    else:
+        return (values[middle - 1] + values[middle]) / 2.0
@@ -22,6 +22,85 @@ import itertools
 import re
 
 
+# reference properties of each object class and the classes they refer
+# to, as defined by the org.consonant-project.toucan.schema.0 schema
+REFERENCE_PROPERTIES = {
+    'info': {},
+    'view': {'lanes': 'lane'},
+    'lane': {'views': 'view', 'cards': 'card'},
+    'card': {'creator': 'user', 'lane': 'lane', 'milestone': 'milestone',
+             'reason': 'reason', 'assignees': 'user', 'comments': 'comment'},
+    'reason': {},
+    'milestone': {},
+    'user': {'default-view': 'view'},
+    'comment': {'card': 'card', 'author': 'user', 'attachment': 'attachment'},
+    'attachment': {'comment': 'comment'},
+}
+
+# text properties of each object class that can be matched against
+# patterns, as defined by the same schema
+TEXT_PROPERTIES = {
+    'info': ['name', 'description'],
+    'view': ['name', 'description'],
+    'lane': ['name', 'description'],
+    'card': ['title', 'description'],
+    'reason': ['short-name', 'name', 'description'],
+    'milestone': ['short-name', 'name', 'description'],
+    'user': ['name', 'email', 'avatar'],
+    'comment': ['comment'],
+    'attachment': ['name'],
+}
+
+
+class QueryError(Exception):
+
+    """Errors occuring while parsing or evaluating object queries."""
+
+    pass
+
+
+class Query(object):
+
+    """A query for objects of a class that satisfy a list of predicates.
+
+    Queries are written as "CLASS where PREDICATE and PREDICATE ...",
+    where each predicate is of the form "PROPERTY=PATTERN" or
+    "PROPERTY!=PATTERN". Patterns are matched against the short names
+    of referenced objects or the values of text properties.
+
+    """
+
+    def __init__(self, class_name, predicates):
+        """Initialise a Query."""
+        self.class_name = class_name
+        self.predicates = predicates
+
+    @staticmethod
+    def is_query(text):
+        """Return whether a text is a query rather than a name pattern."""
+        return re.match(r'^\s*[a-z-]+\s+where\s', text) is not None
+
+    @staticmethod
+    def parse(text):
+        """Parse a query text into a Query."""
+        match = re.match(r'^\s*([a-z-]+)\s+where\s+(.+?)\s*$', text)
+        if not match:
+            raise QueryError('Query "%s" is not of the form '
+                             '"CLASS where PROPERTY=PATTERN and ..."' % text)
+
+        predicates = []
+        for predicate in re.split(r'\s+and\s+', match.group(2)):
+            predicate_match = re.match(
+                r'^([a-z-]+)\s*(!=|=)\s*(\S+)$', predicate)
+            if not predicate_match:
+                raise QueryError('Predicate "%s" is not of the form '
+                                 '"PROPERTY=PATTERN" or "PROPERTY!=PATTERN"' %
+                                 predicate)
+            predicates.append(predicate_match.groups())
+
+        return Query(match.group(1), predicates)
+
+
 class NameGenerator(object):
 
     """Generate user-friendly names for objects of different classes."""
@@ -148,6 +227,112 @@ class NameResolver(object):
         self.name_generator = NameGenerator()
         self.service = service
         self.commit = commit
+        self._objects = {}
+        self._indexes = {}
+
+    def resolve(self, patterns):
+        """Return all objects that match the patterns or query.
+
+        Patterns forming a query, such as "card where lane=doing", are
+        resolved with resolve_query(), other patterns are resolved with
+        resolve_patterns().
+
+        """
+        text = ' '.join(patterns)
+        if Query.is_query(text):
+            return self.resolve_query(Query.parse(text))
+        else:
+            return self.resolve_patterns(patterns, None)
+
+    def resolve_query(self, query):
+        """Return all objects that satisfy the predicates of a query.
+
+        Predicates on references are evaluated against the secondary
+        indexes of the commit, so that only the objects of the classes
+        referred to need to be matched against the patterns, instead of
+        resolving the references of every object.
+
+        """
+        if query.class_name not in REFERENCE_PROPERTIES:
+            raise QueryError('Unknown object class "%s"' % query.class_name)
+
+        objects = self._class_objects(query.class_name)
+        result = set(objects.iterkeys())
+        for prop_name, operator, pattern in query.predicates:
+            prop_name = self._query_property(query.class_name, prop_name)
+            matches = self._evaluate_predicate(
+                query.class_name, objects, prop_name, pattern.lower())
+            if operator == '=':
+                result.intersection_update(matches)
+            else:
+                result.difference_update(matches)
+
+        return set(objects[obj_uuid] for obj_uuid in result)
+
+    def _query_property(self, class_name, prop_name):
+        # allow the singular form of list properties, e.g. assignee for
+        # assignees, which reads more naturally in predicates
+        references = REFERENCE_PROPERTIES[class_name]
+        if prop_name not in references and prop_name + 's' in references:
+            return prop_name + 's'
+        return prop_name
+
+    def _evaluate_predicate(self, class_name, objects, prop_name, pattern):
+        # return the UUIDs of objects whose property matches a pattern
+        references = REFERENCE_PROPERTIES[class_name]
+        if prop_name in references:
+            index = self._reference_index(class_name, prop_name)
+            targets = self._class_objects(references[prop_name])
+            result = set()
+            for target_uuid, target in targets.iteritems():
+                names = self.name_generator.short_names(target)
+                if any(self._matches_pattern(pattern, name.lower())
+                       for name in names):
+                    result.update(index.get(target_uuid, ()))
+            return result
+        elif prop_name in TEXT_PROPERTIES[class_name]:
+            result = set()
+            for obj_uuid, obj in objects.iteritems():
+                if prop_name not in obj:
+                    continue
+                value = obj[prop_name]
+                if isinstance(value, basestring) and \
+                        fnmatch.fnmatchcase(value.lower(), pattern):
+                    result.add(obj_uuid)
+            return result
+        else:
+            raise QueryError('Objects of class "%s" have no property "%s"' %
+                             (class_name, prop_name))
+
+    def _class_objects(self, class_name):
+        # return the objects of a class by UUID, loading them only once
+        if class_name not in self._objects:
+            klass = self.service.klass(self.commit, class_name)
+            self._objects[class_name] = dict(
+                (obj.uuid, obj)
+                for obj in self.service.objects(self.commit, klass))
+        return self._objects[class_name]
+
+    def _reference_index(self, class_name, prop_name):
+        # build a secondary index mapping the UUIDs of referenced objects
+        # to the UUIDs of the objects referring to them, e.g. lane to
+        # cards or user to assigned cards. the index is built from the
+        # UUIDs stored in the references, without resolving them
+        key = (class_name, prop_name)
+        if key not in self._indexes:
+            index = {}
+            for obj_uuid, obj in self._class_objects(class_name).iteritems():
+                if prop_name not in obj:
+                    continue
+                value = obj[prop_name]
+                if isinstance(value, list):
+                    references = [element.value for element in value]
+                else:
+                    references = [value]
+                for reference in references:
+                    index.setdefault(reference.uuid, set()).add(obj_uuid)
+            self._indexes[key] = index
+        return self._indexes[key]
 
     def resolve_patterns(self, patterns, class_name):
         """Return all objects that match the patterns and class."""
@@ -25,9 +25,15 @@ class ObjectClassListRenderer(object):
 
     """Render the objects of a class to a text stream."""
 
-    def __init__(self, service):
-        """Initialise an ObjectClassListRenderer."""
+    def __init__(self, service, ranked=False):
+        """Initialise an ObjectClassListRenderer.
+
+        Objects are sorted by name, unless they are ranked, in which
+        case they are rendered in the order they are passed in.
+
+        """
         self.service = service
+        self.ranked = ranked
 
     def render(self, stream, objects):
         """Render a list of objects to a text stream."""
@@ -51,6 +57,13 @@ class ObjectClassListRenderer(object):
             for row in rows:
                 stream.write('%s\n' % (format_string % row))
 
+    def sort(self, objects, key):
+        """Sort a list of objects by a key, unless they are ranked."""
+        if self.ranked:
+            return objects
+        else:
+            return sorted(objects, key=key)
+
 
 class InfoListRenderer(ObjectClassListRenderer):
 
@@ -71,7 +84,7 @@ class ViewListRenderer(ObjectClassListRenderer):
     def render(self, stream, views):
         """Render a list of views to a text stream."""
         rows = []
-        for view in sorted(views, key=lambda view: view['name']):
+        for view in self.sort(views, lambda view: view['name']):
             if 'lanes' in view:
                 num_lanes = len(view['lanes'])
             else:
@@ -88,7 +101,7 @@ class LaneListRenderer(ObjectClassListRenderer):
     def render(self, stream, lanes):
         """Render a list of lanes to a text stream."""
         rows = []
-        for lane in sorted(lanes, key=lambda lane: lane['name']):
+        for lane in self.sort(lanes, lambda lane: lane['name']):
             if 'cards' in lane:
                 num_cards = len(lane['cards'])
             else:
@@ -105,7 +118,7 @@ class UserListRenderer(ObjectClassListRenderer):
     def render(self, stream, users):
         """Render a list of users to a text stream."""
         rows = []
-        for user in sorted(users, key=lambda user: user['name']):
+        for user in self.sort(users, lambda user: user['name']):
             roles = [role.value for role in user['roles']]
             rows.append(('user', user['name'], user['email'], ','.join(roles)))
         self.render_rows(stream, rows)
@@ -118,7 +131,7 @@ class UserConfigListRenderer(ObjectClassListRenderer):
     def render(self, stream, configs):
         """Render a list of user configs to a text stream."""
         rows = []
-        for config in sorted(configs, key=self._sort_key):
+        for config in self.sort(configs, self._sort_key):
             user = self.service.resolve_reference(config['user'])
             if 'default-view' in config:
                 default_view = config['default-view']
@@ -132,18 +145,59 @@ class UserConfigListRenderer(ObjectClassListRenderer):
         return user['name']
 
 
+class CardListRenderer(ObjectClassListRenderer):
+
+    """Render lists of card objects to a text stream."""
+
+    def render(self, stream, cards):
+        """Render a list of cards to a text stream."""
+        name_generator = toucanlib.cli.names.NameGenerator()
+        rows = []
+        for card in self.sort(cards, lambda card: card['title']):
+            rows.append(('card', name_generator.presentable_name(card),
+                         card['title'].strip()))
+        self.render_rows(stream, rows)
+
+
+class CommentListRenderer(ObjectClassListRenderer):
+
+    """Render lists of comment objects to a text stream."""
+
+    def render(self, stream, comments):
+        """Render a list of comments to a text stream."""
+        name_generator = toucanlib.cli.names.NameGenerator()
+        rows = []
+        for comment in self.sort(comments, lambda comment: comment.uuid):
+            rows.append(('comment', name_generator.presentable_name(comment),
+                         ' '.join(comment['comment'].split())))
+        self.render_rows(stream, rows)
+
+
 class ListRenderer(object):
 
     """Render lists of objects to a text stream."""
 
-    def __init__(self, service):
-        """Initialise a ListRenderer."""
+    def __init__(self, service, ranked=False):
+        """Initialise a ListRenderer.
+
+        Objects are rendered in groups by class. Ranked objects, such
+        as search results, keep their order within each group and the
+        groups are ordered by their best ranked object.
+
+        """
         self.service = service
+        self.ranked = ranked
 
     def render(self, stream, objects):
         """Render a list of objects to a text stream."""
         groups = self._group_objects(objects)
-        names = sorted(groups.iterkeys())
+        if self.ranked:
+            names = []
+            for obj in objects:
+                if obj.klass.name not in names:
+                    names.append(obj.klass.name)
+        else:
+            names = sorted(groups.iterkeys())
         for name in names:
             self._render_group(stream, name, groups[name])
 
@@ -160,19 +214,32 @@ class ListRenderer(object):
         getattr(self, render_group_func)(stream, objects)
 
     def _render_info_group(self, stream, objects):
-        return InfoListRenderer(self.service).render(stream, objects)
+        return InfoListRenderer(self.service, self.ranked).render(
+            stream, objects)
 
     def _render_lane_group(self, stream, objects):
-        return LaneListRenderer(self.service).render(stream, objects)
+        return LaneListRenderer(self.service, self.ranked).render(
+            stream, objects)
 
     def _render_view_group(self, stream, objects):
-        return ViewListRenderer(self.service).render(stream, objects)
+        return ViewListRenderer(self.service, self.ranked).render(
+            stream, objects)
 
     def _render_user_group(self, stream, objects):
-        return UserListRenderer(self.service).render(stream, objects)
+        return UserListRenderer(self.service, self.ranked).render(
+            stream, objects)
 
     def _render_user_config_group(self, stream, objects):
-        return UserConfigListRenderer(self.service).render(stream, objects)
+        return UserConfigListRenderer(self.service, self.ranked).render(
+            stream, objects)
+
+    def _render_card_group(self, stream, objects):
+        return CardListRenderer(self.service, self.ranked).render(
+            stream, objects)
+
+    def _render_comment_group(self, stream, objects):
+        return CommentListRenderer(self.service, self.ranked).render(
+            stream, objects)
 
 
 class ObjectClassShowRenderer(object):
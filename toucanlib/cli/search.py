@@ -0,0 +1,299 @@
+# Copyright (C) 2014 Codethink Limited.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Full-text search over the objects of Toucan boards."""
+
+
+import cPickle
+import hashlib
+import logging
+import math
+import os
+import re
+import tempfile
+
+import toucanlib
+
+
+# text properties that are indexed for each object class, along with
+# the weight of their terms when ranking results
+INDEXED_PROPERTIES = {
+    'card': [('title', 3.0), ('description', 1.0)],
+    'comment': [('comment', 1.0)],
+    'lane': [('description', 1.0)],
+    'view': [('description', 1.0)],
+}
+
+# BM25 ranking parameters
+K1 = 1.2
+B = 0.75
+
+
+def tokenize(text):
+    """Split a text into lower-case search terms."""
+    return re.findall(r'\w+', text.lower(), re.UNICODE)
+
+
+class SearchIndex(object):
+
+    """An inverted index of the text properties of objects in a commit.
+
+    The index maps search terms to the objects whose indexed properties
+    contain them. Each indexed object is recorded as a document with a
+    fingerprint of its indexed text, so that objects whose text has not
+    changed are not re-indexed when they are updated.
+
+    """
+
+    def __init__(self):
+        """Initialise an empty SearchIndex."""
+        self.sha1 = None
+        self.documents = {}
+        self.postings = {}
+        self.total_length = 0.0
+
+    def update_object(self, class_name, obj):
+        """Add or update the document of an object.
+
+        Returns whether the indexed text of the object has changed.
+
+        """
+        texts = [(obj[name], weight)
+                 for name, weight in INDEXED_PROPERTIES[class_name]
+                 if name in obj]
+        fingerprint = self._fingerprint(texts)
+        document = self.documents.get(obj.uuid)
+        if document is not None and document[1] == fingerprint:
+            return False
+        self._remove_document(obj.uuid)
+        self._add_document(obj.uuid, class_name, fingerprint, texts)
+        return True
+
+    def remove_object(self, obj_uuid):
+        """Remove the document of an object, returning whether it existed."""
+        return self._remove_document(obj_uuid)
+
+    def search(self, query):
+        """Return (uuid, class name, score) tuples for a query.
+
+        Only objects that contain all terms of the query are returned.
+        The results are ranked using BM25, highest scores first.
+
+        """
+        terms = set(tokenize(query))
+        if not terms or not self.documents:
+            return []
+
+        postings = [self.postings.get(term, {}) for term in terms]
+        postings.sort(key=len)
+        matches = set(postings[0])
+        for term_postings in postings[1:]:
+            matches.intersection_update(term_postings)
+
+        num_documents = len(self.documents)
+        average_length = self.total_length / num_documents
+        scores = dict((obj_uuid, 0.0) for obj_uuid in matches)
+        for term_postings in postings:
+            frequency = len(term_postings)
+            idf = math.log(1.0 + (num_documents - frequency + 0.5) /
+                           (frequency + 0.5))
+            for obj_uuid in matches:
+                tf = term_postings[obj_uuid]
+                norm = 1.0 - B + B * \
+                    self.documents[obj_uuid][2] / average_length
+                scores[obj_uuid] += idf * tf * (K1 + 1) / (tf + K1 * norm)
+
+        results = [(obj_uuid, self.documents[obj_uuid][0], score)
+                   for obj_uuid, score in scores.iteritems()]
+        results.sort(key=lambda result: (-result[2], result[0]))
+        return results
+
+    def _fingerprint(self, texts):
+        digest = hashlib.sha1()
+        for text, weight in texts:
+            digest.update(repr((text, weight)))
+        return digest.hexdigest()
+
+    def _add_document(self, obj_uuid, class_name, fingerprint, texts):
+        frequencies = {}
+        for text, weight in texts:
+            for term in tokenize(text):
+                frequencies[term] = frequencies.get(term, 0.0) + weight
+        length = sum(frequencies.itervalues())
+
+        # documents hold the class name, text fingerprint, weighted
+        # length and terms of each object, the latter being needed to
+        # remove the object from the postings again
+        self.documents[obj_uuid] = \
+            (class_name, fingerprint, length, frequencies.keys())
+        for term, frequency in frequencies.iteritems():
+            self.postings.setdefault(term, {})[obj_uuid] = frequency
+        self.total_length += length
+
+    def _remove_document(self, obj_uuid):
+        document = self.documents.pop(obj_uuid, None)
+        if document is None:
+            return False
+        for term in document[3]:
+            term_postings = self.postings[term]
+            del term_postings[obj_uuid]
+            if not term_postings:
+                del self.postings[term]
+        self.total_length -= document[2]
+        return True
+
+
+class Searcher(object):
+
+    """Search the objects of a board using cached inverted indexes.
+
+    Indexes are cached per commit SHA1, in memory and, if a cache
+    directory is given, on disk. When searching a commit for which no
+    index is cached, the most recently cached index of the board is
+    updated incrementally instead of indexing all objects from scratch.
+    The objects to re-index are found by comparing the trees of the
+    commit of that index and the commit being searched, so that only
+    objects that were added, changed or removed in between are loaded.
+
+    """
+
+    def __init__(self, repo, cache_dir=None, max_cached=5):
+        """Initialise a Searcher for a pygit2 repository."""
+        self.reader = toucanlib.cli.history.StoreReader(repo)
+        self.cache_dir = cache_dir
+        self.max_cached = max_cached
+        self._index = None
+
+    def index(self, commit):
+        """Return the search index for a commit."""
+        if self._index is not None and self._index.sha1 == commit.hex:
+            return self._index
+
+        index = self._load_cached(commit.hex)
+        if index is None:
+            index = self._index or self._load_latest() or SearchIndex()
+            base = index.sha1
+            index, changes = self._update(index, commit)
+            logging.info('Updated search index from %s to %s: '
+                         '%d documents changed' %
+                         (base, commit.hex, changes))
+            self._store_cached(index)
+        self._index = index
+        return index
+
+    def search(self, commit, query):
+        """Return the objects in a commit matching a query, best first."""
+        results = self.index(commit).search(query)
+
+        # only load the objects that were found
+        return [self.reader.load_object(commit, class_name, obj_uuid)
+                for obj_uuid, class_name, score in results]
+
+    def _update(self, index, commit):
+        # update the index by the objects that differ between the
+        # commit it was built for and the new commit. an index for a
+        # commit that no longer exists is replaced by a new one
+        base_commit = None
+        if index.sha1 is not None:
+            try:
+                base_commit = self.reader.commit(index.sha1)
+            except toucanlib.cli.history.HistoryError:
+                index = SearchIndex()
+
+        changes = 0
+        for class_name in sorted(INDEXED_PROPERTIES.iterkeys()):
+            changed = self.reader.changed_objects(
+                base_commit, commit, class_name)
+            for obj_uuid, old_id, new_id in changed:
+                if new_id is None:
+                    changes += index.remove_object(obj_uuid)
+                else:
+                    obj = self.reader.load_blob(
+                        new_id, class_name, obj_uuid, cached=False)
+                    changes += index.update_object(class_name, obj)
+
+        index.sha1 = commit.hex
+        return index, changes
+
+    def _cache_path(self, sha1):
+        return os.path.join(self.cache_dir, sha1)
+
+    def _load_cached(self, sha1):
+        if not self.cache_dir:
+            return None
+        return self._load_index(self._cache_path(sha1))
+
+    def _load_latest(self):
+        # any cached index can serve as the base of an incremental
+        # update, but the most recent one usually differs the least
+        # from the commit being searched
+        for filename in self._cached_files():
+            index = self._load_index(os.path.join(self.cache_dir, filename))
+            if index is not None:
+                return index
+        return None
+
+    def _load_index(self, path):
+        try:
+            with open(path, 'rb') as stream:
+                version, index = cPickle.load(stream)
+            if version != toucanlib.__version__:
+                return None
+            return index
+        except IOError:
+            return None
+        except Exception, e:
+            logging.warning('Ignoring invalid search index cache %s: %s' %
+                            (path, e))
+            return None
+
+    def _store_cached(self, index):
+        if not self.cache_dir:
+            return
+
+        if not os.path.isdir(self.cache_dir):
+            os.makedirs(self.cache_dir)
+
+        # write the cache entry to a temporary file first, so that other
+        # processes never see incomplete entries
+        handle, temp_path = tempfile.mkstemp(dir=self.cache_dir)
+        with os.fdopen(handle, 'wb') as stream:
+            cPickle.dump((toucanlib.__version__, index), stream,
+                         cPickle.HIGHEST_PROTOCOL)
+        os.rename(temp_path, self._cache_path(index.sha1))
+
+        # drop the oldest indexes, they are superseded by newer ones
+        for filename in self._cached_files()[self.max_cached:]:
+            try:
+                os.unlink(os.path.join(self.cache_dir, filename))
+            except OSError:
+                pass
+
+    def _cached_files(self):
+        # return the cached indexes, most recently written first
+        try:
+            filenames = [filename for filename in os.listdir(self.cache_dir)
+                         if re.match(r'^[0-9a-f]{40}$', filename)]
+        except OSError:
+            return []
+
+        def mtime(filename):
+            try:
+                return os.path.getmtime(
+                    os.path.join(self.cache_dir, filename))
+            except OSError:
+                return 0
+        return sorted(filenames, key=mtime, reverse=True)
@@ -17,17 +17,34 @@
 """Representation, parsing and execution of Toucan board setup files."""
 
 
+import collections
 import consonant
+import cPickle
+import hashlib
+import json
+import logging
 import mimetypes
+import multiprocessing
 import os
 import pygit2
+import tempfile
 import time
+import toucanlib
+import uuid
 import yaml
 
 from consonant.store import properties
 from consonant.transaction import actions, transaction
-from consonant.util import expressions, gitcli
-from consonant.util.phase import Phase
+from consonant.util import expressions
+from consonant.util.phase import PhaseError
+from yaml.composer import Composer
+from yaml.constructor import SafeConstructor
+from yaml.resolver import Resolver
+
+try:
+    from yaml import CSafeLoader as SafeLoader, CSafeDumper as SafeDumper
+except ImportError:
+    from yaml import SafeLoader, SafeDumper
 
 
 class MetaData(object):
@@ -54,6 +71,8 @@ class View(object):
 
     """A view definition in a board setup file."""
 
+    __slots__ = ('name', 'description', 'lanes')
+
     def __init__(self, name, description, lanes):
         """Initialise a View object."""
         self.name = name
@@ -65,6 +84,8 @@ class Lane(object):
 
     """A lane definition in a board setup file."""
 
+    __slots__ = ('name', 'description', 'cards')
+
     def __init__(self, name, description, cards):
         """Initialise a Lane object."""
         self.name = name
@@ -76,6 +97,8 @@ class User(object):
 
     """A user definition in a board setup file."""
 
+    __slots__ = ('name', 'email', 'roles', 'default_view', 'avatar')
+
     def __init__(self, name, email, roles, default_view, avatar):
         """Initialise a User object."""
         self.name = name
@@ -89,6 +112,9 @@ class Card(object):
 
     """A card definition in a board setup file."""
 
+    __slots__ = ('id', 'title', 'creator', 'description', 'lane', 'reason',
+                 'milestone', 'assignees', 'comments')
+
     def __init__(self, identifier, title, creator, description,
                  lane, reason, milestone, assignees, comments):
         """Initialise a Card object."""
@@ -107,6 +133,8 @@ class Reason(object):
 
     """A reason definition in a board setup file."""
 
+    __slots__ = ('short_name', 'name', 'description', 'work_items')
+
     def __init__(self, short_name, name, description, work_items):
         """Initialise a Reason object."""
         self.short_name = short_name
@@ -119,6 +147,8 @@ class Milestone(object):
 
     """A milestone definition in a board setup file."""
 
+    __slots__ = ('short_name', 'name', 'description', 'deadline')
+
     def __init__(self, short_name, name, description, deadline):
         """Initialise a Milestone object."""
         self.short_name = short_name
@@ -131,6 +161,8 @@ class Comment(object):
 
     """A comment definition in a board setup file."""
 
+    __slots__ = ('id', 'content', 'author', 'attachment', 'card')
+
     def __init__(self, identifier, content, author, attachment, card):
         """Initialise a Comment object."""
         self.id = identifier
@@ -144,6 +176,8 @@ class Attachment(object):
 
     """An attachment definition in a board setup file."""
 
+    __slots__ = ('name', 'path', 'comment')
+
     def __init__(self, name, path, comment):
         """Initialise an Attachment object."""
         self.name = name
@@ -159,6 +193,9 @@ class SetupFile(object):
         """Initialise a SetupFile."""
         self.filename = filename
 
+        # Absolute paths of the files included by the setup file.
+        self.includes = []
+
         # The setup file can define any of the following, so all of them
         # should have the potential to be loaded.
         self.meta_data = None
@@ -173,45 +210,451 @@ class SetupFile(object):
         self.attachments = {}
 
 
+class SetupProgress(object):
+
+    """Reports the progress of the stages of setting up a board.
+
+    Stages process a number of items, e.g. setup file entries or store
+    objects. Every event is reported by calling the report function with
+    a dict holding the event type ('start', 'progress', 'finish' or
+    'message'), the stage name, the number of items done and in total,
+    if known, the elapsed time, the rate in items per second and the
+    estimated time remaining in seconds, if it can be computed. Progress
+    within a stage is reported at most once per interval in seconds.
+
+    """
+
+    def __init__(self, report=None, interval=1.0):
+        """Initialise a SetupProgress."""
+        self.report = report
+        self.interval = interval
+        self.stage = None
+        self.total = None
+        self.done = 0
+        self._start = self._last = time.time()
+
+    def start(self, stage, total=None):
+        """Start a stage, optionally with the number of items to process."""
+        self.stage = stage
+        self.total = total
+        self.done = 0
+        self._start = self._last = time.time()
+        self._report('start')
+
+    def advance(self, count=1):
+        """Record that a number of items has been processed."""
+        self.update(self.done + count)
+
+    def update(self, done):
+        """Record the number of items processed in the stage so far."""
+        self.done = done
+        if self.report:
+            now = time.time()
+            if now - self._last >= self.interval:
+                self._last = now
+                self._report('progress')
+
+    def finish(self, done=None):
+        """Finish the stage, optionally with the final number of items."""
+        if done is not None:
+            self.done = done
+        self._report('finish')
+
+    def message(self, message):
+        """Report a message about the current stage."""
+        if self.report:
+            self.report({
+                'event': 'message',
+                'stage': self.stage,
+                'message': message,
+                })
+
+    def _report(self, event):
+        if not self.report:
+            return
+        elapsed = time.time() - self._start
+        rate = self.done / elapsed if elapsed > 0 else None
+        if rate and self.total is not None:
+            eta = max(self.total - self.done, 0) / rate
+        else:
+            eta = None
+        self.report({
+            'event': event,
+            'stage': self.stage,
+            'done': self.done,
+            'total': self.total,
+            'elapsed': elapsed,
+            'rate': rate,
+            'eta': eta,
+            })
+
+
+class SetupPlan(object):
+
+    """The actions that setting up a board from a setup file would take."""
+
+    def __init__(self):
+        """Initialise a SetupPlan."""
+        # Number of objects to be created, by class name.
+        self.objects = collections.OrderedDict()
+
+        self.references = 0
+        self.actions = 0
+        self.commits = 0
+        self.attachments = 0
+        self.attachment_bytes = 0
+
+        # Estimated size of the transactions in bytes, including the
+        # attachment data.
+        self.transaction_size = 0
+
+
 class SetupParserError(Exception):
 
-    """Errors occuring while parsing Toucan board setup files."""
+    """Errors occuring while parsing Toucan board setup files.
+
+    The message is only formatted with its arguments when the error is
+    converted to a string. This keeps collecting errors cheap and allows
+    to group errors by their message format.
+
+    """
+
+    def __init__(self, message, *args):
+        """Initialise a SetupParserError."""
+        Exception.__init__(self, message, *args)
+        self.format = message
+        self.format_args = args
+
+    def __str__(self):
+        """Return the error message formatted with its arguments."""
+        if self.format_args:
+            return self.format % self.format_args
+        else:
+            return self.format
+
+
+class SetupRunnerError(Exception):
+
+    """Errors occuring while setting up a board from a setup file."""
+
+    pass
+
+
+class SetupUpdateError(SetupRunnerError):
+
+    """Errors occuring while updating a board from a setup file."""
+
+    pass
+
+
+class SetupErrorLimitReached(Exception):
+
+    """Raised when a SetupPhase has collected the maximum number of errors."""
 
     pass
 
 
+class SetupPhaseError(PhaseError):
+
+    """Errors collected in a setup phase, grouped by category for display."""
+
+    # the number of errors shown for each category
+    samples = 3
+
+    def __init__(self, errors, limit_reached):
+        """Initialise a SetupPhaseError."""
+        PhaseError.__init__(self, errors)
+        self.limit_reached = limit_reached
+
+    def categories(self):
+        """Return (category, errors) pairs in order of first occurrence.
+
+        Parser errors are categorised by their unformatted message, all
+        other errors by their type and message.
+
+        """
+        categories = collections.OrderedDict()
+        for error in self.errors:
+            if isinstance(error, SetupParserError):
+                category = error.format
+            else:
+                category = '%s: %s' % (error.__class__.__name__, error)
+            if category not in categories:
+                categories[category] = []
+            categories[category].append(error)
+        return categories.items()
+
+    def __str__(self):
+        """Return sample errors and error counts for all categories."""
+        lines = []
+        if self.limit_reached and len(self.errors) == 1:
+            lines.append('Stopped after the first error')
+        elif self.limit_reached:
+            lines.append('Stopped after reaching the maximum of %d errors' %
+                         len(self.errors))
+        for category, errors in self.categories():
+            for error in errors[:self.samples]:
+                lines.append('%s: %s' % (error.__class__.__name__, error))
+            if len(errors) > self.samples:
+                lines.append('  (%d errors like these, %d shown)' %
+                             (len(errors), self.samples))
+        return '\n'.join(lines)
+
+
+class SetupPhase(object):
+
+    """A phase of parsing setup files that collects errors.
+
+    This works like consonant's Phase, except that it stops the phase
+    once a maximum number of errors has been collected and raises a
+    SetupPhaseError that summarises the errors by category.
+
+    """
+
+    def __init__(self, max_errors=None):
+        """Initialise a SetupPhase."""
+        self.max_errors = max_errors
+        self.errors = []
+
+    def error(self, error):
+        """Record an error and stop the phase if the limit is reached."""
+        self.errors.append(error)
+        if self.max_errors and len(self.errors) >= self.max_errors:
+            raise SetupErrorLimitReached()
+
+    def __enter__(self):
+        """Enter the phase."""
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        """Leave the phase, raising a SetupPhaseError if errors occured."""
+        if exc_type is SetupErrorLimitReached:
+            raise SetupPhaseError(self.errors, True)
+        elif exc_type is None and self.errors:
+            raise SetupPhaseError(self.errors, False)
+
+
+class SetupStream(Composer, SafeConstructor, Resolver):
+
+    """Read the top-level sections of a setup file from YAML events.
+
+    Lists at the top level of the setup file are never constructed as a
+    whole. Instead, their entries are composed and constructed one at a
+    time, so that only a single entry is held in memory at any point.
+
+    """
+
+    def __init__(self, stream):
+        """Initialise a SetupStream for a YAML stream."""
+        Composer.__init__(self)
+        SafeConstructor.__init__(self)
+        Resolver.__init__(self)
+        self.events = yaml.parse(stream, Loader=SafeLoader)
+        self.event = None
+
+    def sections(self):
+        """Yield (name, value, is_list) tuples for all top-level sections.
+
+        The value of a list section is a generator that produces the
+        entries of the list. It has to be consumed before moving on to
+        the next section, otherwise its remaining entries are skipped.
+
+        """
+        self.get_event()
+        if not self.check_event(yaml.DocumentStartEvent):
+            raise SetupParserError('Setup file is not a YAML dictionary.')
+        self.get_event()
+        if not self.check_event(yaml.MappingStartEvent):
+            raise SetupParserError('Setup file is not a YAML dictionary.')
+        self.get_event()
+
+        while not self.check_event(yaml.MappingEndEvent):
+            name = self.construct_document(self.compose_node(None, None))
+            if self.check_event(yaml.SequenceStartEvent):
+                self.get_event()
+                entries = self._entries()
+                yield name, entries, True
+                for entry in entries:
+                    pass
+            else:
+                value = self.construct_document(self.compose_node(None, None))
+                yield name, value, False
+        self.get_event()
+
+    def _entries(self):
+        while not self.check_event(yaml.SequenceEndEvent):
+            yield self.construct_document(self.compose_node(None, None))
+        self.get_event()
+
+    def check_event(self, *choices):
+        """Check whether the next event is of one of the given types."""
+        event = self.peek_event()
+        if event is None:
+            return False
+        if not choices:
+            return True
+        return isinstance(event, choices)
+
+    def peek_event(self):
+        """Return the next event without consuming it."""
+        if self.event is None:
+            self.event = next(self.events, None)
+        return self.event
+
+    def get_event(self):
+        """Consume and return the next event."""
+        event = self.peek_event()
+        self.event = None
+        return event
+
+
+class SetupRecordStream(object):
+
+    """Read the top-level sections of a JSON Lines setup file.
+
+    Every line of a JSON Lines setup file is a JSON object that maps
+    section names to values, e.g. {"cards": {"id": 1, ...}}. Entries of
+    list sections may be spread over any number of lines, each holding
+    either a single entry or a list of entries. Lines are read one at a
+    time, so only a single record is held in memory at any point.
+
+    """
+
+    # sections whose values are lists of entries
+    list_sections = ('views', 'lanes', 'users', 'cards', 'reasons',
+                     'milestones', 'comments', 'attachments')
+
+    def __init__(self, stream):
+        """Initialise a SetupRecordStream for a JSON Lines stream."""
+        self.stream = stream
+
+    def sections(self):
+        """Yield (name, value, is_list) tuples for all records.
+
+        The value of a list section is an iterator over the entries
+        in the record. A section may be yielded more than once.
+
+        """
+        for lineno, line in enumerate(self.stream, 1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError, e:
+                raise SetupParserError(
+                    'Setup file line %d is not valid JSON: %s', lineno, e)
+            if not isinstance(record, dict):
+                raise SetupParserError(
+                    'Setup file line %d is not a JSON object.', lineno)
+            for name, value in record.iteritems():
+                if name in self.list_sections:
+                    if not isinstance(value, list):
+                        value = [value]
+                    yield name, iter(value), True
+                else:
+                    yield name, value, False
+
+
 class SetupParser(object):
 
     """A parser for Toucan board setup files."""
 
+    # the keys by which objects in each section are referred to
+    reference_keys = {
+        'views': 'name',
+        'lanes': 'name',
+        'users': 'name',
+        'cards': 'id',
+        'reasons': 'short-name',
+        'milestones': 'short-name',
+        'attachments': 'name',
+        }
+
+    # sections that are validated and loaded one entry at a time
+    # when parsing setup files in streaming mode
+    streamed_sections = ('cards', 'comments', 'attachments')
+
+    def __init__(self, processes=None, cache_dir=None, max_errors=None,
+                 progress=None):
+        """Initialise a SetupParser.
+
+        Files included by a setup file are parsed concurrently using the
+        given number of processes, or one process per CPU if it is None.
+        If a cache directory is given, parsed setup files are stored in
+        and loaded from there as long as the setup file, the files it
+        includes, its attachments and the Toucan version are unchanged.
+        Parsing stops after max_errors errors if a limit is given. The
+        parse, validate and load stages are reported to the given
+        SetupProgress, if any.
+
+        """
+        self.processes = processes
+        self.cache_dir = cache_dir
+        self.max_errors = max_errors
+        self.progress = progress or SetupProgress()
+        self._strings = {}
+
     def parse(self, filename, stream):
         """Parse a file stream and return a SetupFile on success."""
-        # phase 1: load the input YAML
-        with Phase() as phase:
+        return self._parse_cached(self._parse, filename, stream)
+
+    def parse_streaming(self, filename, stream):
+        """Parse a seekable file stream one entry at a time.
+
+        Unlike parse(), this never holds the entire setup data in memory.
+        The stream is read twice: the first pass keeps all sections
+        except for cards, comments and attachments in memory and collects
+        the names and ids that can be referred to, the second pass
+        validates and loads cards, comments and attachments one by one.
+        Included files are read one after another in both passes.
+
+        """
+        return self._parse_cached(self._parse_streaming, filename, stream)
+
+    def _phase(self):
+        return SetupPhase(self.max_errors)
+
+    def _parse(self, filename, stream):
+        # phase 1: load the input YAML and all included files
+        with self._phase() as phase:
+            start = time.time()
+            self.progress.start('parse')
             try:
-                data = yaml.load(stream)
+                data = self._read_data(filename, stream)
+                includes = self._included_files(filename, data)
             except Exception, e:
                 phase.error(e)
+            else:
+                self._read_included_files(phase, includes, data)
+                self.progress.finish(self._count_entries(data))
+            logging.info('Loaded setup file %s using %s in %.3fs' %
+                         (filename, self._reader_name(filename),
+                          time.time() - start))
 
         # phase 2: validate the setup data
-        with Phase() as phase:
+        with self._phase() as phase:
+            self.progress.start('validate', self._count_entries(data))
             if not isinstance(data, dict):
                 phase.error(SetupParserError(
-                    'Setup file is not a YAML dictionary.'))
+                    'Setup file is not a %s.',
+                    self._mapping_name(filename)))
             else:
+                refs = self._index_references(data)
                 self._validate_meta_data(phase, data)
                 self._validate_board_info(phase, data)
-                self._validate_views(phase, data)
-                self._validate_lanes(phase, data)
-                self._validate_users(phase, data)
-                self._validate_cards(phase, data)
+                self._validate_views(phase, data, refs)
+                self._validate_lanes(phase, data, refs)
+                self._validate_users(phase, data, refs)
+                self._validate_cards(phase, data, refs)
                 self._validate_reasons(phase, data)
                 self._validate_milestones(phase, data)
-                self._validate_comments(phase, data)
-                self._validate_attachments(phase, data)
+                self._validate_comments(phase, data, refs)
+                self._validate_attachments(phase, data, refs)
+            self.progress.finish()
 
         # phase 3: load the setup data into a SetupFile
-        with Phase() as phase:
+        with self._phase() as phase:
+            self.progress.start('load', self._count_entries(data))
             setup_file = SetupFile(filename)
             self._load_meta_data(phase, data, setup_file)
             self._load_board_info(phase, data, setup_file)
@@ -223,9 +666,375 @@ class SetupParser(object):
             self._load_milestones(phase, data, setup_file)
             self._load_comments(phase, data, setup_file)
             self._load_attachments(phase, data, setup_file)
+            setup_file.includes = includes
+            self.progress.finish()
 
             return setup_file
 
+    def _parse_streaming(self, filename, stream):
+        # phase 1: read small sections and index the large ones
+        with self._phase() as phase:
+            start = time.time()
+            self.progress.start('parse')
+            try:
+                data, refs, includes = self._scan_sections(filename, stream)
+            except Exception, e:
+                phase.error(e)
+            else:
+                self.progress.finish(self._count_entries(data))
+            logging.info('Scanned setup file %s using %s in %.3fs' %
+                         (filename, self._reader_name(filename),
+                          time.time() - start))
+
+        # phase 2: validate the setup data, loading the large sections
+        # into the SetupFile as their entries are validated
+        setup_file = SetupFile(filename)
+        setup_file.includes = includes
+        with self._phase() as phase:
+            self.progress.start('validate')
+            self._validate_meta_data(phase, data)
+            self._validate_board_info(phase, data)
+            self._validate_views(phase, data, refs)
+            self._validate_lanes(phase, data, refs)
+            self._validate_users(phase, data, refs)
+            self._validate_reasons(phase, data)
+            self._validate_milestones(phase, data)
+
+            stream.seek(0)
+            self._stream_sections(
+                phase, filename, stream, refs, setup_file, False)
+            for path in includes:
+                with open(path, 'r') as included:
+                    self._stream_sections(
+                        phase, path, included, refs, setup_file, True)
+            self.progress.finish()
+
+        # phase 3: load the remaining setup data into the SetupFile
+        with self._phase() as phase:
+            self.progress.start('load', self._count_entries(data))
+            self._load_meta_data(phase, data, setup_file)
+            self._load_board_info(phase, data, setup_file)
+            self._load_views(phase, data, setup_file)
+            self._load_lanes(phase, data, setup_file)
+            self._load_users(phase, data, setup_file)
+            self._load_reasons(phase, data, setup_file)
+            self._load_milestones(phase, data, setup_file)
+            self.progress.finish()
+
+            return setup_file
+
+    def _parse_cached(self, parse, filename, stream):
+        if not self.cache_dir:
+            return parse(filename, stream)
+
+        # cache entries are looked up by the path of the setup file and
+        # only used while it and the files it depends on are unchanged
+        digest = hashlib.sha1(toucanlib.__version__)
+        digest.update(os.path.abspath(filename))
+        path = os.path.join(self.cache_dir, digest.hexdigest())
+
+        setup_file = self._load_cached(path)
+        if setup_file is not None:
+            logging.info('Loaded setup file %s from cache %s' %
+                         (filename, path))
+            return setup_file
+
+        # hash the setup file and rewind the stream before parsing it,
+        # so that the cache entry records the content that was parsed
+        try:
+            info = os.stat(filename)
+        except OSError:
+            return parse(filename, stream)
+        digest = hashlib.sha1()
+        _hash_stream(digest, stream)
+        stream.seek(0)
+        setup_file = parse(filename, stream)
+        self._store_cached(path, setup_file, {
+            filename: (info.st_size, info.st_mtime, digest.hexdigest())})
+        return setup_file
+
+    def _load_cached(self, path):
+        # load a cached SetupFile, unless it does not exist or any of
+        # the files the setup file depends on have changed since it
+        # was cached; files are only hashed again if their size or
+        # modification time differ from those recorded in the entry
+        try:
+            with open(path, 'rb') as stream:
+                dependencies, setup_file = cPickle.load(stream)
+            touched = False
+            for filename, (size, mtime, digest) in dependencies.items():
+                info = os.stat(filename)
+                if (info.st_size, info.st_mtime) == (size, mtime):
+                    continue
+                if info.st_size != size or _hash_file(filename) != digest:
+                    return None
+                dependencies[filename] = (size, info.st_mtime, digest)
+                touched = True
+        except (IOError, OSError):
+            return None
+        except Exception, e:
+            logging.warning('Ignoring invalid setup file cache %s: %s' %
+                            (path, e))
+            return None
+
+        # record new modification times of files that were touched but
+        # not changed, so that they are not hashed again next time
+        if touched:
+            self._write_cached(path, dependencies, setup_file)
+        return setup_file
+
+    def _store_cached(self, path, setup_file, dependencies):
+        try:
+            for filename in setup_file.includes:
+                dependencies[filename] = _file_state(filename)
+            for attachment in setup_file.attachments.itervalues():
+                dependencies[attachment.path] = _file_state(attachment.path)
+        except (IOError, OSError), e:
+            # attachments that cannot be read are only reported when
+            # populating the store, so just skip caching the setup file
+            logging.warning('Not caching setup file %s: %s' %
+                            (setup_file.filename, e))
+            return
+        self._write_cached(path, dependencies, setup_file)
+
+    def _write_cached(self, path, dependencies, setup_file):
+        if not os.path.isdir(self.cache_dir):
+            os.makedirs(self.cache_dir)
+
+        # write the cache entry to a temporary file first, so that other
+        # processes never see incomplete entries
+        handle, temp_path = tempfile.mkstemp(dir=self.cache_dir)
+        with os.fdopen(handle, 'wb') as stream:
+            cPickle.dump((dependencies, setup_file), stream,
+                         cPickle.HIGHEST_PROTOCOL)
+        os.rename(temp_path, path)
+
+    def _format(self, filename):
+        extension = os.path.splitext(filename)[1].lower()
+        if extension == '.json':
+            return 'json'
+        elif extension == '.jsonl':
+            return 'jsonl'
+        else:
+            return 'yaml'
+
+    def _reader_name(self, filename):
+        if self._format(filename) == 'yaml':
+            return SafeLoader.__name__
+        else:
+            return 'json'
+
+    def _mapping_name(self, filename):
+        if self._format(filename) == 'yaml':
+            return 'YAML dictionary'
+        else:
+            return 'JSON object'
+
+    def _read_data(self, filename, stream):
+        # read the entire setup data into memory, picking the input
+        # format based on the file extension
+        file_format = self._format(filename)
+        if file_format == 'json':
+            return json.load(stream)
+        elif file_format == 'jsonl':
+            data = {}
+            for section, value, is_list in self._read_sections(
+                    filename, stream):
+                self._merge_section(data, section, value, is_list)
+            return data
+        else:
+            return yaml.load(stream, Loader=SafeLoader)
+
+    def _read_sections(self, filename, stream):
+        # read the setup data section by section. plain JSON cannot be
+        # parsed incrementally, so JSON files are loaded as a whole and
+        # only presented as sections for compatibility
+        file_format = self._format(filename)
+        if file_format == 'json':
+            data = json.load(stream)
+            if not isinstance(data, dict):
+                raise SetupParserError('Setup file is not a JSON object.')
+            return ((section, iter(value), True)
+                    if isinstance(value, list) else (section, value, False)
+                    for section, value in data.iteritems())
+        elif file_format == 'jsonl':
+            return SetupRecordStream(stream).sections()
+        else:
+            return SetupStream(stream).sections()
+
+    def _merge_section(self, data, section, value, is_list):
+        # JSON Lines files may define the entries of a list section on
+        # many lines, so append them to entries read earlier
+        if is_list:
+            if not isinstance(data.get(section), list):
+                data[section] = []
+            data[section].extend(value)
+        else:
+            data[section] = value
+
+    def _intern(self, value):
+        # share a single copy of strings that occur many times in a setup
+        # file, like the names by which objects refer to each other. the
+        # intern() builtin is not used as it does not support unicode
+        return self._strings.setdefault(value, value)
+
+    def _intern_list(self, values):
+        return [self._intern(value) for value in values]
+
+    def _included_files(self, filename, data):
+        # return the absolute paths of the files included by a setup
+        # file, removing the include entry from the setup data
+        if not isinstance(data, dict) or 'include' not in data:
+            return []
+        includes = data.pop('include')
+        if not isinstance(includes, list):
+            raise SetupParserError(
+                'Setup file defines a non-list include entry.')
+        for path in includes:
+            if not isinstance(path, basestring):
+                raise SetupParserError(
+                    'Setup file includes a non-string path: %s', path)
+        dirname = os.path.dirname(filename)
+        return [os.path.abspath(os.path.join(dirname, path))
+                for path in includes]
+
+    def _read_included_files(self, phase, includes, data):
+        # parse included files concurrently and merge their entries
+        # into the setup data in the order the files are included in
+        if len(includes) > 1 and self.processes != 1:
+            pool = multiprocessing.Pool(self.processes)
+            try:
+                results = pool.map(_read_included_file, includes)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            results = [_read_included_file(path) for path in includes]
+
+        for path, included, error in results:
+            if error:
+                phase.error(SetupParserError(error))
+            else:
+                for section, entries in included.iteritems():
+                    self._merge_section(data, section, entries, True)
+
+    def _read_included_data(self, path):
+        # read an included setup file into memory and check that it
+        # only defines list sections, which can be merged
+        with open(path, 'r') as stream:
+            data = self._read_data(path, stream)
+        if not isinstance(data, dict):
+            raise SetupParserError(
+                'Included setup file %s is not a %s.',
+                path, self._mapping_name(path))
+        for section, value in data.iteritems():
+            self._check_included_section(
+                path, section, isinstance(value, list))
+        if 'attachments' in data:
+            for attachment in data['attachments']:
+                self._resolve_attachment_path(path, attachment)
+        return data
+
+    def _check_included_section(self, path, section, is_list):
+        if section == 'include':
+            raise SetupParserError(
+                'Included setup file %s includes other files.', path)
+        elif section not in SetupRecordStream.list_sections:
+            raise SetupParserError(
+                'Included setup file %s defines a %s entry, which is only '
+                'allowed in the main setup file.', path, section)
+        elif not is_list:
+            raise SetupParserError(
+                'Included setup file %s defines a non-list %s entry.',
+                path, section)
+
+    def _resolve_attachment_path(self, filename, attachment):
+        # make relative attachment paths absolute based on the setup
+        # file that defines the attachment, which may be an included
+        # file in a different directory than the main setup file
+        if isinstance(attachment, dict) \
+                and isinstance(attachment.get('path'), basestring) \
+                and not os.path.isabs(attachment['path']):
+            attachment['path'] = os.path.abspath(os.path.join(
+                os.path.dirname(filename), attachment['path']))
+        return attachment
+
+    def _scan_sections(self, filename, stream):
+        data = {}
+        refs = {}
+        self._scan_file_sections(filename, stream, data, refs, False)
+        includes = self._included_files(filename, data)
+        for path in includes:
+            with open(path, 'r') as included:
+                self._scan_file_sections(path, included, data, refs, True)
+        for section, key in self.reference_keys.iteritems():
+            if section not in refs:
+                refs[section] = self._collect_keys(data, section, key)
+        return data, refs, includes
+
+    def _scan_file_sections(self, filename, stream, data, refs, included):
+        for section, value, is_list in self._read_sections(filename, stream):
+            if included:
+                self._check_included_section(filename, section, is_list)
+            if section in self.streamed_sections:
+                if is_list and section in self.reference_keys:
+                    if section not in refs:
+                        refs[section] = set()
+                    refs[section].update(self._index_entries(
+                        value, self.reference_keys[section]))
+            else:
+                self._merge_section(data, section, value, is_list)
+
+    def _stream_sections(self, phase, filename, stream, refs, setup_file,
+                         included):
+        for section, value, is_list in self._read_sections(filename, stream):
+            if included and section == 'attachments':
+                value = (self._resolve_attachment_path(filename, x)
+                         for x in value)
+            if section in self.streamed_sections:
+                self._stream_section(
+                    phase, section, value, is_list, refs, setup_file)
+
+    def _stream_section(self, phase, section, value, is_list, refs,
+                        setup_file):
+        if not is_list:
+            # let the section validator report the invalid section
+            validate = getattr(self, '_validate_%s' % section)
+            validate(phase, {section: value}, refs)
+        else:
+            validate = getattr(self, '_validate_%s' % section[:-1])
+            load = getattr(self, '_load_%s' % section[:-1])
+            for entry in value:
+                self.progress.advance()
+                num_errors = len(phase.errors)
+                validate(phase, entry, refs)
+                if len(phase.errors) == num_errors:
+                    load(phase, entry, setup_file)
+
+    def _count_entries(self, data):
+        if not isinstance(data, dict):
+            return 0
+        return sum(len(data[x]) for x in SetupRecordStream.list_sections
+                   if isinstance(data.get(x), list))
+
+    def _index_references(self, data):
+        # collect the names and ids that objects in the setup file can
+        # be referred to by once, so that references can be validated
+        # without scanning the referenced section over and over again
+        return dict((section, self._collect_keys(data, section, key))
+                    for section, key in self.reference_keys.iteritems())
+
+    def _collect_keys(self, data, section, key):
+        entries = data.get(section, [])
+        if not isinstance(entries, list):
+            return set()
+        return self._index_entries(entries, key)
+
+    def _index_entries(self, entries, key):
+        return set(x[key] for x in entries
+                   if isinstance(x, dict) and key in x
+                   and isinstance(x[key], (basestring, int)))
+
     def _validate_meta_data(self, phase, data):
         # validate the service name
         if 'name' not in data:
@@ -233,11 +1042,11 @@ class SetupParser(object):
                 'Setup file defines no service name'))
         elif not isinstance(data['name'], basestring):
             phase.error(SetupParserError(
-                'Setup file defines a non-string service name: %s' %
+                'Setup file defines a non-string service name: %s',
                 data['name']))
         elif not expressions.service_name.match(data['name']):
             phase.error(SetupParserError(
-                'Setup file defines an invalid service name: %s' %
+                'Setup file defines an invalid service name: %s',
                 data['name']))
 
         # validate the schema name
@@ -246,11 +1055,11 @@ class SetupParser(object):
                 'Setup file defines no schema name'))
         elif not isinstance(data['schema'], basestring):
             phase.error(SetupParserError(
-                'Setup file defines a non-string schema name: %s' %
+                'Setup file defines a non-string schema name: %s',
                 data['schema']))
         elif not expressions.schema_name.match(data['schema']):
             phase.error(SetupParserError(
-                'Setup file defines an invalid schema name: %s' %
+                'Setup file defines an invalid schema name: %s',
                 data['schema']))
 
     def _load_meta_data(self, phase, data, setup_file):
@@ -262,7 +1071,7 @@ class SetupParser(object):
                 'Setup file defines no board info'))
         elif not isinstance(data['info'], dict):
             phase.error(SetupParserError(
-                'Setup file defines non-dict board info: %s' %
+                'Setup file defines non-dict board info: %s',
                 data['info']))
         else:
             # validate the board name
@@ -271,14 +1080,14 @@ class SetupParser(object):
                     'Setup file defines no board name'))
             elif not isinstance(data['info']['name'], basestring):
                 phase.error(SetupParserError(
-                    'Setup file defines a non-string board name: %s' %
+                    'Setup file defines a non-string board name: %s',
                     data['info']['name']))
 
             # validate the board description
             if 'description' in data['info'] and \
                     not isinstance(data['info']['description'], basestring):
                 phase.error(SetupParserError(
-                    'Setup file defines a non-string board description: %s' %
+                    'Setup file defines a non-string board description: %s',
                     data['info']['description']))
 
     def _load_board_info(self, phase, data, setup_file):
@@ -286,7 +1095,7 @@ class SetupParser(object):
             data['info']['name'],
             data['info'].get('description', None))
 
-    def _validate_views(self, phase, data):
+    def _validate_views(self, phase, data, refs):
         if 'views' not in data:
             return
 
@@ -295,18 +1104,19 @@ class SetupParser(object):
                 'Setup file defines a non-list views entry'))
         else:
             for view in data['views']:
+                self.progress.advance()
                 if not isinstance(view, dict):
                     phase.error(SetupParserError(
-                        'Setup file defines a non-dict view: %s' % view))
+                        'Setup file defines a non-dict view: %s', view))
                 else:
                     # validate the view name
                     if 'name' not in view:
                         phase.error(SetupParserError(
-                            'Setup file defines a view without a name: %s' %
+                            'Setup file defines a view without a name: %s',
                             view))
                     elif not isinstance(view['name'], basestring):
                         phase.error(SetupParserError(
-                            'Setup file defines a non-string view name: %s' %
+                            'Setup file defines a non-string view name: %s',
                             view['name']))
 
                     # validate the view description
@@ -315,46 +1125,42 @@ class SetupParser(object):
                                 view['description'], basestring):
                         phase.error(SetupParserError(
                             'Setup file defines a non-string view '
-                            'description: %s' % view['description']))
+                            'description: %s', view['description']))
 
                     # validate the lane references in the view
                     if 'lanes' not in view:
                         phase.error(SetupParserError(
-                            'Setup file defines a view with no lanes: %s' %
+                            'Setup file defines a view with no lanes: %s',
                             view))
                     elif not isinstance(view['lanes'], list):
                         phase.error(SetupParserError(
                             'Setup file defines a view with a non-list '
-                            'lanes entry: %s' % view))
+                            'lanes entry: %s', view))
                     else:
                         for lane in view['lanes']:
                             if not isinstance(lane, basestring):
                                 phase.error(SetupParserError(
                                     'Setup file defines a view with a '
-                                    'non-string lane name reference: %s' %
+                                    'non-string lane name reference: %s',
+                                    lane))
+                            elif lane not in refs['lanes']:
+                                phase.error(SetupParserError(
+                                    'Setup file defines a view that '
+                                    'refers to a non-existent lane: %s',
                                     lane))
-                            else:
-                                lanes = [x for x in data.get('lanes', [])
-                                         if isinstance(x, dict)
-                                         and 'name' in x]
-                                matches = [x for x in lanes
-                                           if x['name'] == lane]
-                                if not matches:
-                                    phase.error(SetupParserError(
-                                        'Setup file defines a view that '
-                                        'refers to a non-existent lane: %s' %
-                                        lane))
 
     def _load_views(self, phase, data, setup_file):
         if 'views' not in data:
             return
         for view in data['views']:
-            setup_file.views[view['name']] = View(
-                view['name'],
+            self.progress.advance()
+            name = self._intern(view['name'])
+            setup_file.views[name] = View(
+                name,
                 view.get('description', None),
-                view.get('lanes', []))
+                self._intern_list(view.get('lanes', [])))
 
-    def _validate_lanes(self, phase, data):
+    def _validate_lanes(self, phase, data, refs):
         if 'lanes' not in data:
             return
 
@@ -363,18 +1169,19 @@ class SetupParser(object):
                 'Setup file defines a non-lists lanes entry'))
         else:
             for lane in data['lanes']:
+                self.progress.advance()
                 if not isinstance(lane, dict):
                     phase.error(SetupParserError(
-                        'Setup file defines a non-dict lane: %s' % lane))
+                        'Setup file defines a non-dict lane: %s', lane))
                 else:
                     # validate the lane name
                     if 'name' not in lane:
                         phase.error(SetupParserError(
-                            'Setup file defines a lane without a name: %s' %
+                            'Setup file defines a lane without a name: %s',
                             lane))
                     elif not isinstance(lane['name'], basestring):
                         phase.error(SetupParserError(
-                            'Setup file defines a non-string lane name: %s' %
+                            'Setup file defines a non-string lane name: %s',
                             lane['name']))
 
                     # validate the lane description
@@ -383,30 +1190,24 @@ class SetupParser(object):
                                 lane['description'], basestring):
                         phase.error(SetupParserError(
                             'Setup file defines a non-string lane '
-                            'description: %s' % lane['description']))
+                            'description: %s', lane['description']))
 
                     if 'cards' in lane:
                         if not isinstance(lane['cards'], list):
                             phase.error(SetupParserError(
                                 'Setup file defines a lane with non-list '
-                                'cards property: %s' % lane['cards']))
+                                'cards property: %s', lane['cards']))
                         else:
                             for card in lane['cards']:
                                 if not isinstance(card, int):
                                     phase.error(SetupParserError(
                                         'Setup file defines a comment with '
-                                        'non-int card reference: %s' % card))
-                                else:
-                                    cards = [x for x in data.get('cards', [])
-                                             if isinstance(x, dict)
-                                             and 'id' in x]
-                                    matches = [x for x in cards
-                                               if x['id'] in lane['cards']]
-                                    if not matches:
-                                        phase.error(SetupParserError(
-                                            'Setup file defines a lane '
-                                            'with non-existant card reference:'
-                                            ' %s' % card))
+                                        'non-int card reference: %s', card))
+                                elif card not in refs['cards']:
+                                    phase.error(SetupParserError(
+                                        'Setup file defines a lane '
+                                        'with non-existant card reference:'
+                                        ' %s', card))
 
             # detect ambiguous lanes with the same name
             valid_lanes = [x for x in data['lanes']
@@ -419,19 +1220,21 @@ class SetupParser(object):
             for name, lanes in names.iteritems():
                 if len(lanes) > 1:
                     phase.error(SetupParserError(
-                        'Setup file defines %d lanes with the same name: %s' %
-                        (len(lanes), name)))
+                        'Setup file defines %d lanes with the same name: %s',
+                        len(lanes), name))
 
     def _load_lanes(self, phase, data, setup_file):
         if 'lanes' not in data:
             return
         for lane in data['lanes']:
-            setup_file.lanes[lane['name']] = Lane(
-                lane['name'],
+            self.progress.advance()
+            name = self._intern(lane['name'])
+            setup_file.lanes[name] = Lane(
+                name,
                 lane.get('description', None),
                 lane.get('cards', []))
 
-    def _validate_users(self, phase, data):
+    def _validate_users(self, phase, data, refs):
         if 'users' not in data:
             phase.error(SetupParserError(
                 'Setup file defines no users'))
@@ -441,15 +1244,16 @@ class SetupParser(object):
                     'Setup file defines a non-list users entry'))
             else:
                 for user in data['users']:
+                    self.progress.advance()
                     if not isinstance(user, dict):
                         phase.error(SetupParserError(
-                            'Setup file defines a non-dict user: %s' % user))
-                else:
-                    self._validate_user_name(phase, user)
-                    self._validate_user_email(phase, user)
-                    self._validate_user_roles(phase, user)
-                    self._validate_user_default_view(phase, user, data)
-                    self._validate_user_avatar(phase, user)
+                            'Setup file defines a non-dict user: %s', user))
+                    else:
+                        self._validate_user_name(phase, user)
+                        self._validate_user_email(phase, user)
+                        self._validate_user_roles(phase, user)
+                        self._validate_user_default_view(phase, user, refs)
+                        self._validate_user_avatar(phase, user)
                 self._validate_user_ambiguity(phase, data)
                 self._validate_user_admin(phase, data)
 
@@ -457,62 +1261,57 @@ class SetupParser(object):
         # validate user name
         if 'name' not in user:
             phase.error(SetupParserError(
-                'Setup file defines a user without a name: %s' % user))
+                'Setup file defines a user without a name: %s', user))
         elif not isinstance(user['name'], basestring):
             phase.error(SetupParserError(
-                'Setup file defines a non-string user name: %s' %
+                'Setup file defines a non-string user name: %s',
                 user['name']))
 
     def _validate_user_email(self, phase, user):
         # validate user email
         if 'email' not in user:
             phase.error(SetupParserError(
-                'Setup file defines a user without an email address: %s' %
+                'Setup file defines a user without an email address: %s',
                 user))
         elif not isinstance(user['email'], basestring):
             phase.error(SetupParserError(
-                'Setup file defines a non-string user email: %s' %
+                'Setup file defines a non-string user email: %s',
                 user['email']))
 
     def _validate_user_roles(self, phase, user):
         # validate user roles
         if 'roles' not in user:
             phase.error(SetupParserError(
-                'Setup file defines a user with no roles: %s' % user))
+                'Setup file defines a user with no roles: %s', user))
         elif not isinstance(user['roles'], list):
             phase.error(SetupParserError(
-                'Setup file defines a non-list user roles entry: %s' %
+                'Setup file defines a non-list user roles entry: %s',
                 user['roles']))
         else:
             for role in user['roles']:
                 if not isinstance(role, basestring):
                     phase.error(SetupParserError(
-                        'Setup file defines a non-string user role: %s' %
+                        'Setup file defines a non-string user role: %s',
                         role))
 
-    def _validate_user_default_view(self, phase, user, data):
+    def _validate_user_default_view(self, phase, user, refs):
         # validate user default-view
         if 'default-view' in user:
             if not isinstance(user['default-view'], basestring):
                 phase.error(SetupParserError(
                     'Setup file defines a non-string user default-view '
-                    'reference: %s' % user['default-view']))
-            else:
-                views = [x for x in data.get('views', [])
-                         if isinstance(x, dict) and 'name' in x]
-                matches = [x for x in views
-                           if x['name'] in user['default-view']]
-                if not matches:
-                    phase.error(SetupParserError(
-                        'Setup file defines a user with non-existant '
-                        'default-view reference: %s' % user['default-view']))
+                    'reference: %s', user['default-view']))
+            elif user['default-view'] not in refs['views']:
+                phase.error(SetupParserError(
+                    'Setup file defines a user with non-existant '
+                    'default-view reference: %s', user['default-view']))
 
     def _validate_user_avatar(self, phase, user):
         # validate user avatar
         if 'avatar' in user:
             if not isinstance(user['avatar'], basestring):
                 phase.error(SetupParserError(
-                    'Setup file defines a non-string user avatar: %s' %
+                    'Setup file defines a non-string user avatar: %s',
                     user['avatar']))
 
     def _validate_user_ambiguity(self, phase, data):
@@ -528,7 +1327,7 @@ class SetupParser(object):
             if len(users) > 1:
                 phase.error(SetupParserError(
                     'Setup file defines %d users with the same '
-                    'email address: %s' % (len(users), email)))
+                    'email address: %s', len(users), email))
 
     def _validate_user_admin(self, phase, data):
         # fail if there is no admin user
@@ -548,14 +1347,16 @@ class SetupParser(object):
         if 'users' not in data:
             return
         for user in data['users']:
-            setup_file.users[user['name']] = User(
-                user['name'],
+            self.progress.advance()
+            name = self._intern(user['name'])
+            setup_file.users[name] = User(
+                name,
                 user['email'],
-                user.get('roles', []),
-                user.get('default-view', ''),
+                self._intern_list(user.get('roles', [])),
+                self._intern(user.get('default-view', '')),
                 user.get('avatar', ''))
 
-    def _validate_cards(self, phase, data):
+    def _validate_cards(self, phase, data, refs):
         if 'cards' not in data:
             return
 
@@ -564,152 +1365,139 @@ class SetupParser(object):
                 'Setup file defines a non-list cards entry.'))
         else:
             for card in data['cards']:
-                if not isinstance(card, dict):
-                    phase.error(SetupParserError(
-                        'Setup file defines a non-dict card: %s' % card))
-                else:
-                    self._validate_card_id(phase, card)
-                    self._validate_card_title(phase, card)
-                    self._validate_card_creator(phase, card, data)
-                    self._validate_card_description(phase, card)
-                    self._validate_card_lane(phase, card, data)
-                    self._validate_card_milestone(phase, card, data)
-                    self._validate_card_reason(phase, card, data)
-                    self._validate_card_assignees(phase, card, data)
+                self.progress.advance()
+                self._validate_card(phase, card, refs)
+
+    def _validate_card(self, phase, card, refs):
+        if not isinstance(card, dict):
+            phase.error(SetupParserError(
+                'Setup file defines a non-dict card: %s', card))
+        else:
+            self._validate_card_id(phase, card)
+            self._validate_card_title(phase, card)
+            self._validate_card_creator(phase, card, refs)
+            self._validate_card_description(phase, card)
+            self._validate_card_lane(phase, card, refs)
+            self._validate_card_milestone(phase, card, refs)
+            self._validate_card_reason(phase, card, refs)
+            self._validate_card_assignees(phase, card, refs)
 
     def _validate_card_id(self, phase, card):
         if 'id' not in card:
             phase.error(SetupParserError(
-                'Setup file defines a card without an id: %s' % card))
+                'Setup file defines a card without an id: %s', card))
         elif not isinstance(card['id'], int):
             phase.error(SetupParserError(
-                'Setup file defines a card with non-int id: %s' % card['id']))
+                'Setup file defines a card with non-int id: %s', card['id']))
 
     def _validate_card_title(self, phase, card):
         # validate card title
         if 'title' not in card:
             phase.error(SetupParserError(
-                'Setup file defines a card without a title: %s' % card))
+                'Setup file defines a card without a title: %s', card))
         elif not isinstance(card['title'], basestring):
             phase.error(SetupParserError(
-                'Setup file defines a card with non-string title: %s' %
+                'Setup file defines a card with non-string title: %s',
                 card['title']))
 
-    def _validate_card_creator(self, phase, card, data):
+    def _validate_card_creator(self, phase, card, refs):
         # validate card creator
         if 'creator' not in card:
             phase.error(SetupParserError(
-                'Setup file defines a card without a creator: %s' % card))
+                'Setup file defines a card without a creator: %s', card))
         elif not isinstance(card['creator'], basestring):
             phase.error(SetupParserError(
-                'Setup file defines a card with non-string creator: %s' %
+                'Setup file defines a card with non-string creator: %s',
                 card['creator']))
-        else:
-            users = [x for x in data.get('users', [])
-                     if isinstance(x, dict) and 'name' in x]
-            matches = [x for x in users if x['name'] == card['creator']]
-            if not matches:
-                phase.error(SetupParserError(
-                    'Setup file defines a card that refers '
-                    'to a non-existent user: %s' % card))
+        elif card['creator'] not in refs['users']:
+            phase.error(SetupParserError(
+                'Setup file defines a card that refers '
+                'to a non-existent user: %s', card))
 
     def _validate_card_description(self, phase, card):
         # validate card description
         if 'description' in card and \
                 not isinstance(card['description'], basestring):
             phase.error(SetupParserError(
-                'Setup file defines a card with non-string description: %s' %
+                'Setup file defines a card with non-string description: %s',
                 card['description']))
 
-    def _validate_card_lane(self, phase, card, data):
+    def _validate_card_lane(self, phase, card, refs):
         # validate card lane
         if 'lane' not in card:
             phase.error(SetupParserError(
-                'Setup file defines a card without a lane: %s' % card))
+                'Setup file defines a card without a lane: %s', card))
         elif not isinstance(card['lane'], basestring):
             phase.error(SetupParserError(
-                'Setup file defines a card with non-string lane: %s' %
+                'Setup file defines a card with non-string lane: %s',
                 card['lane']))
-        else:
-            lanes = [x for x in data.get('lanes', [])
-                     if isinstance(x, dict) and 'name' in x]
-            matches = [x for x in lanes if x['name'] == card['lane']]
-            if not matches:
-                phase.error(SetupParserError(
-                    'Setup file defines a card that refers '
-                    'to a non-existent lane: %s' % card))
+        elif card['lane'] not in refs['lanes']:
+            phase.error(SetupParserError(
+                'Setup file defines a card that refers '
+                'to a non-existent lane: %s', card))
 
-    def _validate_card_milestone(self, phase, card, data):
+    def _validate_card_milestone(self, phase, card, refs):
         # validate card milestone
         if 'milestone' in card:
             if not isinstance(card['milestone'], basestring):
                 phase.error(SetupParserError(
                     'Setup file defines a card with non-string '
-                    'milestone reference: %s' % card['milestone']))
-            else:
-                milestones = [x for x in data.get('milestones', [])
-                              if isinstance(x, dict) and 'name' in x]
-                matches = [x for x in milestones
-                           if x['short-name'] == card['milestone']]
-                if not matches:
-                    phase.error(SetupParserError(
-                        'Setup file defines a card that refers '
-                        'to a non-existent milestone: %s' % card))
+                    'milestone reference: %s', card['milestone']))
+            elif card['milestone'] not in refs['milestones']:
+                phase.error(SetupParserError(
+                    'Setup file defines a card that refers '
+                    'to a non-existent milestone: %s', card))
 
-    def _validate_card_reason(self, phase, card, data):
+    def _validate_card_reason(self, phase, card, refs):
         # validate card reason
         if 'reason' not in card:
             phase.error(SetupParserError(
-                'Setup file defines a card without a reason: %s' % card))
+                'Setup file defines a card without a reason: %s', card))
         elif not isinstance(card['reason'], basestring):
             phase.error(SetupParserError(
                 'Setup file defines a card with non-string '
-                'reason reference: %s' % card['reason']))
-        else:
-            reasons = [x for x in data.get('reasons', [])
-                       if isinstance(x, dict) and 'short-name' in x]
-            matches = [x for x in reasons if x['short-name'] == card['reason']]
-            if not matches:
-                phase.error(SetupParserError(
-                    'Setup file defines a card that refers '
-                    'to a non-existent reason: %s' % card))
+                'reason reference: %s', card['reason']))
+        elif card['reason'] not in refs['reasons']:
+            phase.error(SetupParserError(
+                'Setup file defines a card that refers '
+                'to a non-existent reason: %s', card))
 
-    def _validate_card_assignees(self, phase, card, data):
+    def _validate_card_assignees(self, phase, card, refs):
         # validate card assignees
         if 'assignees' in card:
             if not isinstance(card['assignees'], list):
                 phase.error(SetupParserError(
                     'Setup file defines a card with non-list '
-                    'assignees: %s' % card))
+                    'assignees: %s', card))
             else:
                 for assignee in card['assignees']:
                     if not isinstance(assignee, basestring):
                         phase.error(SetupParserError(
                             'Setup file defines a card with '
-                            'non-string assignee: %s' % card))
-                    else:
-                        users = [x for x in data.get('users', [])
-                                 if isinstance(x, dict) and 'name' in x]
-                        matches = [x for x in users if x['name'] == assignee]
-                        if not matches:
-                            phase.error(SetupParserError(
-                                'Setup file defines a card that refers to '
-                                'a non-existent user: %s' % card))
+                            'non-string assignee: %s', card))
+                    elif assignee not in refs['users']:
+                        phase.error(SetupParserError(
+                            'Setup file defines a card that refers to '
+                            'a non-existent user: %s', card))
 
     def _load_cards(self, phase, data, setup_file):
         if 'cards' not in data:
             return
         for card in data['cards']:
-            setup_file.cards[card['title']] = Card(
-                card['id'],
-                card['title'],
-                card['creator'],
-                card.get('description', None),
-                card['lane'],
-                card['reason'],
-                card.get('milestone', None),
-                card.get('assignees', []),
-                card.get('comments', []))
+            self.progress.advance()
+            self._load_card(phase, card, setup_file)
+
+    def _load_card(self, phase, card, setup_file):
+        setup_file.cards[card['title']] = Card(
+            card['id'],
+            card['title'],
+            self._intern(card['creator']),
+            card.get('description', None),
+            self._intern(card['lane']),
+            self._intern(card['reason']),
+            self._intern(card.get('milestone', None)),
+            self._intern_list(card.get('assignees', [])),
+            card.get('comments', []))
 
     def _validate_reasons(self, phase, data):
         if 'reasons' not in data:
@@ -719,36 +1507,37 @@ class SetupParser(object):
                 'Setup file defines a non-list reasons entry.'))
         else:
             for reason in data['reasons']:
+                self.progress.advance()
                 if not isinstance(reason, dict):
                     phase.error(SetupParserError(
-                        'Setup file defines a non-dict reason: %s' % reason))
+                        'Setup file defines a non-dict reason: %s', reason))
                 else:
                     # validate short_name
                     if 'short-name' not in reason:
                         phase.error(SetupParserError(
                             'Setup file defines a reason without a '
-                            'short-name: %s' % reason))
+                            'short-name: %s', reason))
                     elif not isinstance(reason['short-name'], basestring):
                         phase.error(SetupParserError(
                             'Setup file defines a reason with non-string '
-                            'short_name: %s' % reason['short-name']))
+                            'short_name: %s', reason['short-name']))
 
                     # validate name
                     if 'name' not in reason:
                         phase.error(SetupParserError(
-                            'Setup file defines a reason without a name: %s' %
+                            'Setup file defines a reason without a name: %s',
                             reason))
                     elif not isinstance(reason['name'], basestring):
                         phase.error(SetupParserError(
                             'Setup file defines a reason with non-string '
-                            'name: %s' % reason['name']))
+                            'name: %s', reason['name']))
 
                     # validate description
                     if 'description' in reason:
                         if not isinstance(reason['description'], basestring):
                             phase.error(SetupParserError(
                                 'Setup file defines a reason with non-string '
-                                'description: %s' % reason['description']))
+                                'description: %s', reason['description']))
 
                     # validate work-items
                     # TODO:
@@ -759,9 +1548,11 @@ class SetupParser(object):
         if 'reasons' not in data:
             return
         for reason in data['reasons']:
-            setup_file.reasons[reason['name']] = Reason(
-                reason['short-name'],
-                reason['name'],
+            self.progress.advance()
+            name = self._intern(reason['name'])
+            setup_file.reasons[name] = Reason(
+                self._intern(reason['short-name']),
+                name,
                 reason.get('description', None),
                 reason.get('work-items', []))
 
@@ -773,30 +1564,31 @@ class SetupParser(object):
                 'Setup file defines a non-list milestones entry.'))
         else:
             for milestone in data['milestones']:
+                self.progress.advance()
                 if not isinstance(milestone, dict):
                     phase.error(SetupParserError(
-                        'Setup file defines a non-dict milestone: %s' %
+                        'Setup file defines a non-dict milestone: %s',
                         milestone))
                 else:
                     # validate short_name
                     if 'short-name' not in milestone:
                         phase.error(SetupParserError(
                             'Setup file defines a milestone without a '
-                            'short-name: %s' % milestone))
+                            'short-name: %s', milestone))
                     elif not isinstance(milestone['short-name'], basestring):
                         phase.error(SetupParserError(
                             'Setup file defines a milestone with non-string '
-                            'short_name: %s' % milestone['short-name']))
+                            'short_name: %s', milestone['short-name']))
 
                     # validate name
                     if 'name' not in milestone:
                         phase.error(SetupParserError(
                             'Setup file defines a milestone without a '
-                            'name: %s' % milestone))
+                            'name: %s', milestone))
                     elif not isinstance(milestone['name'], basestring):
                         phase.error(SetupParserError(
                             'Setup file defines a milestone with non-string '
-                            'name: %s' % milestone['name']))
+                            'name: %s', milestone['name']))
 
                     # validate description
                     if 'description' in milestone:
@@ -804,30 +1596,32 @@ class SetupParser(object):
                                 milestone['description'], basestring):
                             phase.error(SetupParserError(
                                 'Setup file defines a milestone with '
-                                'non-string description: %s' %
+                                'non-string description: %s',
                                 milestone['description']))
 
                     # validate deadline
                     if 'deadline' not in milestone:
                         phase.error(SetupParserError(
                             'Setup file defines a milestone without a '
-                            'deadline: %s' % milestone))
+                            'deadline: %s', milestone))
                     elif not isinstance(milestone['deadline'], basestring):
                         phase.error(SetupParserError(
                             'Setup file defines a milestone with non-string '
-                            'deadline: %s' % milestone['deadline']))
+                            'deadline: %s', milestone['deadline']))
 
     def _load_milestones(self, phase, data, setup_file):
         if 'milestones' not in data:
             return
         for milestone in data['milestones']:
-            setup_file.milestones[milestone['short-name']] = Milestone(
-                milestone['short-name'],
+            self.progress.advance()
+            short_name = self._intern(milestone['short-name'])
+            setup_file.milestones[short_name] = Milestone(
+                short_name,
                 milestone['name'],
                 milestone.get('description', None),
                 milestone['deadline'])
 
-    def _validate_comments(self, phase, data):
+    def _validate_comments(self, phase, data, refs):
         if 'comments' not in data:
             return
         if not isinstance(data['comments'], list):
@@ -835,101 +1629,96 @@ class SetupParser(object):
                 'Setup file defines a non-list comments entry.'))
         else:
             for comment in data['comments']:
-                if not isinstance(comment, dict):
-                    phase.error(SetupParserError(
-                        'Setup file defines a non-dict comment: %s' % comment))
-                else:
-                    self._validate_comment_id(phase, comment)
-                    self._validate_comment_comment(phase, comment)
-                    self._validate_comment_author(phase, comment, data)
-                    self._validate_comment_attachment(phase, comment, data)
-                    self._validate_comment_card(phase, comment, data)
+                self.progress.advance()
+                self._validate_comment(phase, comment, refs)
+
+    def _validate_comment(self, phase, comment, refs):
+        if not isinstance(comment, dict):
+            phase.error(SetupParserError(
+                'Setup file defines a non-dict comment: %s', comment))
+        else:
+            self._validate_comment_id(phase, comment)
+            self._validate_comment_comment(phase, comment)
+            self._validate_comment_author(phase, comment, refs)
+            self._validate_comment_attachment(phase, comment, refs)
+            self._validate_comment_card(phase, comment, refs)
 
     def _validate_comment_id(self, phase, comment):
         if 'id' not in comment:
             phase.error(SetupParserError(
-                'Setup file defines a comment without an id: %s' % comment))
+                'Setup file defines a comment without an id: %s', comment))
         elif not isinstance(comment['id'], int):
             phase.error(SetupParserError(
-                'Setup file defines a comment with non-int id: %s' %
+                'Setup file defines a comment with non-int id: %s',
                 comment['id']))
 
     def _validate_comment_comment(self, phase, comment):
         # validate comment
         if 'comment' not in comment:
             phase.error(SetupParserError(
-                'Setup file defines a comment without a comment: %s' %
+                'Setup file defines a comment without a comment: %s',
                 comment))
         elif not isinstance(comment['comment'], basestring):
             phase.error(SetupParserError(
-                'Setup file defines a comment with non-string comment: %s' %
+                'Setup file defines a comment with non-string comment: %s',
                 comment['comment']))
 
-    def _validate_comment_author(self, phase, comment, data):
+    def _validate_comment_author(self, phase, comment, refs):
         # validate author
         if 'author' not in comment:
             phase.error(SetupParserError(
-                'Setup file defines a comment without an author: %s' %
+                'Setup file defines a comment without an author: %s',
                 comment))
         elif not isinstance(comment['author'], basestring):
             phase.error(SetupParserError(
                 'Setup file defines a comment with non-string '
-                'author reference: %s' % comment['author']))
-        else:
-            users = [x for x in data.get('users', [])
-                     if isinstance(x, dict) and 'name' in x]
-            matches = [x for x in users if x['name'] == comment['author']]
-            if not matches:
-                phase.error(SetupParserError(
-                    'Setup file defines a comment with a '
-                    'non-existant author: %s' % comment))
+                'author reference: %s', comment['author']))
+        elif comment['author'] not in refs['users']:
+            phase.error(SetupParserError(
+                'Setup file defines a comment with a '
+                'non-existant author: %s', comment))
 
-    def _validate_comment_attachment(self, phase, comment, data):
+    def _validate_comment_attachment(self, phase, comment, refs):
         # validate attachment
         if 'attachment' in comment:
             if not isinstance(comment['attachment'], basestring):
                 phase.error(SetupParserError(
                     'Setup file defines a comment with non-string '
-                    'attachment reference: %s' % comment))
-            else:
-                attachs = [x for x in data.get('attachments', [])
-                           if isinstance(x, dict) and 'name' in x]
-                matches = [x for x in attachs
-                           if x['name'] == comment['attachment']]
-                if not matches:
-                    phase.error(SetupParserError(
-                        'Setup file defines a comment with '
-                        'non-existant attachment reference: %s' % comment))
+                    'attachment reference: %s', comment))
+            elif comment['attachment'] not in refs['attachments']:
+                phase.error(SetupParserError(
+                    'Setup file defines a comment with '
+                    'non-existant attachment reference: %s', comment))
 
-    def _validate_comment_card(self, phase, comment, data):
+    def _validate_comment_card(self, phase, comment, refs):
         if 'card' not in comment:
             phase.error(SetupParserError(
-                'Setup file defines a comment without a card: %s' % comment))
+                'Setup file defines a comment without a card: %s', comment))
         elif not isinstance(comment['card'], int):
             phase.error(SetupParserError(
                 'Setup file defines a comment with non-int card '
-                'reference: %s' % comment['card']))
-        else:
-            cards = [x for x in data.get('cards', [])
-                     if isinstance(x, dict) and 'id' in x]
-            matches = [x for x in cards if x['id'] == comment['card']]
-            if not matches:
-                phase.error(SetupParserError(
-                    'Setup file defines a comment with '
-                    'non-existant card reference: %s' % comment))
+                'reference: %s', comment['card']))
+        elif comment['card'] not in refs['cards']:
+            phase.error(SetupParserError(
+                'Setup file defines a comment with '
+                'non-existant card reference: %s', comment))
 
     def _load_comments(self, phase, data, setup_file):
         if 'comments' not in data:
             return
         for comment in data['comments']:
-            setup_file.comments[comment['id']] = Comment(
-                comment['id'],
-                comment['comment'],
-                comment['author'],
-                comment.get('attachment', None),
-                comment['card'])
-
-    def _validate_attachments(self, phase, data):
+            self.progress.advance()
+            self._load_comment(phase, comment, setup_file)
+
+    def _load_comment(self, phase, comment, setup_file):
+        setup_file.comments[comment['id']] = Comment(
+            comment['id'],
+            comment['comment'],
+            self._intern(comment['author']),
+            self._intern(comment.get('attachment', None)),
+            comment['card'])
+
+    def _validate_attachments(self, phase, data, refs):
         if 'attachments' not in data:
             return
         if not isinstance(data['attachments'], list):
@@ -937,67 +1726,231 @@ class SetupParser(object):
                 'Setup file defines non-list attachments entry.'))
         else:
             for attachment in data['attachments']:
-                if not isinstance(attachment, dict):
-                    phase.error(SetupParserError(
-                        'Setup file defines a non-dict attachment: %s' %
-                        attachment))
-                else:
-                    # validate name
-                    if 'name' not in attachment:
-                        phase.error(SetupParserError(
-                            'Setup file defines an attachment without a name: '
-                            '%s' % attachment))
-                    elif not isinstance(attachment['name'], basestring):
-                        phase.error(SetupParserError(
-                            'Setup file defines an attachment with non-string '
-                            'name: %s' % attachment['name']))
+                self.progress.advance()
+                self._validate_attachment(phase, attachment, refs)
 
-                    if 'path' not in attachment:
-                        phase.error(SetupParserError(
-                            'Setup file defines an attachment without a path: '
-                            '%s' % attachment))
-                    elif not isinstance(attachment['path'], basestring):
-                        phase.error(SetupParserError(
-                            'Setup file defines an attachment with non-string '
-                            'path: %s' % attachment['path']))
+    def _validate_attachment(self, phase, attachment, refs):
+        if not isinstance(attachment, dict):
+            phase.error(SetupParserError(
+                'Setup file defines a non-dict attachment: %s', attachment))
+        else:
+            # validate name
+            if 'name' not in attachment:
+                phase.error(SetupParserError(
+                    'Setup file defines an attachment without a name: '
+                    '%s', attachment))
+            elif not isinstance(attachment['name'], basestring):
+                phase.error(SetupParserError(
+                    'Setup file defines an attachment with non-string '
+                    'name: %s', attachment['name']))
 
-                    if 'comment' not in attachment:
-                        phase.error(SetupParserError(
-                            'Setup file defines an attachment without a '
-                            'comment: %s' % attachment['comment']))
+            if 'path' not in attachment:
+                phase.error(SetupParserError(
+                    'Setup file defines an attachment without a path: '
+                    '%s', attachment))
+            elif not isinstance(attachment['path'], basestring):
+                phase.error(SetupParserError(
+                    'Setup file defines an attachment with non-string '
+                    'path: %s', attachment['path']))
+
+            if 'comment' not in attachment:
+                phase.error(SetupParserError(
+                    'Setup file defines an attachment without a '
+                    'comment: %s', attachment))
 
     def _load_attachments(self, phase, data, setup_file):
         if 'attachments' not in data:
             return
         for attachment in data['attachments']:
-            if os.path.isabs(attachment['path']):
-                path = attachment['path']
-            else:
-                dirname = os.path.dirname(setup_file.filename)
-                path = os.path.join(dirname, attachment['path'])
-                path = os.path.abspath(path)
-            setup_file.attachments[attachment['name']] = Attachment(
-                attachment['name'], path, attachment['comment'])
+            self.progress.advance()
+            self._load_attachment(phase, attachment, setup_file)
+
+    def _load_attachment(self, phase, attachment, setup_file):
+        if os.path.isabs(attachment['path']):
+            path = attachment['path']
+        else:
+            dirname = os.path.dirname(setup_file.filename)
+            path = os.path.join(dirname, attachment['path'])
+            path = os.path.abspath(path)
+        name = self._intern(attachment['name'])
+        setup_file.attachments[name] = Attachment(
+            name, path, attachment['comment'])
+
+
+def _read_included_file(path):
+    # parse an included setup file, possibly in a worker process. this
+    # is a module-level function so that it can be passed to a process
+    # pool. errors are returned as messages to be reported by the parent
+    # process
+    try:
+        return path, SetupParser()._read_included_data(path), None
+    except SetupParserError, e:
+        return path, None, str(e)
+    except Exception, e:
+        return path, None, 'Failed to load included setup file %s: %s' % (
+            path, e)
+
+
+def _hash_file(filename):
+    digest = hashlib.sha1()
+    with open(filename, 'rb') as stream:
+        _hash_stream(digest, stream)
+    return digest.hexdigest()
+
+
+def _file_state(filename):
+    # return the size, modification time and SHA-1 of a file, stating
+    # it first so that changes made while hashing are noticed later
+    info = os.stat(filename)
+    return info.st_size, info.st_mtime, _hash_file(filename)
+
+
+def _hash_stream(digest, stream):
+    for chunk in iter(lambda: stream.read(65536), ''):
+        digest.update(chunk)
+
+
+def _serialize_properties(props):
+    # used by worker processes when bulk loading boards
+    return yaml.dump(props, Dumper=SafeDumper, default_flow_style=False)
+
+
+def setup_board(setup_file, repo=None, **options):
+    """Set up a board from a parsed setup file and return its store.
+
+    The board is created in the given pygit2 repository, which may be
+    bare but must not have a master branch yet, and the repository is
+    returned. Without a repository, the board is created in a new
+    in-memory MemoryService, which is returned instead. This avoids all
+    disk I/O, e.g. in test suites, but requires an author to be given.
+    All keyword arguments are passed on to SetupRunner.
+
+    """
+    runner = SetupRunner(**options)
+    if repo is None:
+        if not runner.author:
+            raise SetupRunnerError(
+                'An author is required to set up a board in memory')
+        service = toucanlib.memory.MemoryService()
+        runner.populate(service, setup_file, runner.author)
+        return service
+    else:
+        runner.run(repo, setup_file)
+        return repo
 
 
 class SetupRunner(object):
 
     """A class that performs a setup against a repository and setup file."""
 
+    # properties that objects only have if they are set in the setup file
+    optional_properties = {
+        'info': ['description'],
+        'view': ['description'],
+        'lane': ['description', 'cards'],
+        'user': ['avatar', 'default-view'],
+        'card': ['description', 'milestone', 'assignees', 'comments'],
+        'reason': ['description'],
+        'milestone': ['description'],
+        'comment': ['attachment'],
+        'attachment': [],
+        }
+
+    # number of objects and attachments from which bulk loading uses
+    # worker processes if no number of processes is given
+    parallel_threshold = 50000
+
+    def __init__(self, batch_size=None, progress=None, bulk_load=False,
+                 processes=None, author=None):
+        """Initialise a SetupRunner.
+
+        By default, the store is populated in a single commit. If a batch
+        size is given, cards, comments and attachments are instead added
+        in a series of commits with roughly that many objects each. The
+        plan and apply stages are reported to the given SetupProgress, if
+        any, with progress updates after every commit.
+
+        With bulk loading enabled, run() does not apply a transaction
+        but writes the objects into the git tree of the populate commit
+        directly, which is a lot faster for large boards. The batch size
+        is ignored in this case. Attachments are then streamed into blobs
+        from disk, whereas transactions carry the data of all attachments
+        they add in memory, so boards with large sets of attachments need
+        to be bulk loaded. Objects are serialised and attachments hashed
+        by the given number of worker processes. If no number is given,
+        one process per CPU is used for boards with at least
+        parallel_threshold objects and attachments, and smaller boards
+        are prepared in this process.
+
+        Commits are authored by the given author signature. If there is
+        none, the user.name and user.email options from the git
+        configuration of the repository are used.
+
+        """
+        self.batch_size = batch_size
+        self.progress = progress or SetupProgress()
+        self.bulk_load = bulk_load
+        self.processes = processes
+        self.author = author
+        self._factory = None
+
     def run(self, repo, setup_file):
         """Perform the board setup against a repository and setup file."""
-        author = pygit2.Signature(
-            gitcli.subcommand(repo, ['config', 'user.name']),
-            gitcli.subcommand(repo, ['config', 'user.email']))
-
-        self._create_initial_commit(repo, setup_file, author)
-        self._populate_store(repo, setup_file, author)
+        author = self._author(repo)
+        commit_oid = self._create_initial_commit(repo, setup_file, author)
+        if self.bulk_load:
+            self._bulk_load_store(repo, setup_file, author, commit_oid)
+        else:
+            self._populate_store(repo, setup_file, author)
+
+    def run_update(self, repo, setup_file):
+        """Update the board in an existing repository from a setup file."""
+        author = self._author(repo)
+        store = self._store(repo)
+
+        # refuse to turn a board into a different service or schema
+        commit = store.ref('master').head
+        if store.name(commit) != setup_file.meta_data.service_name:
+            raise SetupUpdateError(
+                'Board uses the service name "%s" instead of "%s"' %
+                (store.name(commit), setup_file.meta_data.service_name))
+        if store.schema(commit).name != setup_file.meta_data.schema_name:
+            raise SetupUpdateError(
+                'Board uses the schema "%s" instead of "%s"' %
+                (store.schema(commit).name, setup_file.meta_data.schema_name))
+
+        self.update(store, setup_file, author)
+
+    def _author(self, repo):
+        # create a new signature for every board, so that its time is
+        # the time the board is created at
+        if self.author:
+            return pygit2.Signature(self.author.name, self.author.email)
+
+        # read the identity from the repository config in-process, which
+        # includes the global and system config, instead of running git
+        identity = []
+        for key in ['user.name', 'user.email']:
+            try:
+                identity.append(repo.config[key])
+            except KeyError:
+                raise SetupRunnerError(
+                    'No author given and %s is not set in the git '
+                    'configuration' % key)
+        return pygit2.Signature(*identity)
+
+    def _store(self, repo):
+        # obtain a Consonant store for the repository, reusing the
+        # service factory for all boards set up by this runner
+        if self._factory is None:
+            self._factory = consonant.service.factories.ServiceFactory()
+        return self._factory.service(repo.path)
 
     def _create_initial_commit(self, repo, setup_file, author):
         builder = repo.TreeBuilder()
         self._create_meta_data(repo, setup_file, builder)
         tree_oid = builder.write()
-        repo.create_commit(
+        return repo.create_commit(
             'refs/heads/master',
             author, author,
             'Create store for board "%s"' % setup_file.board_info.name,
@@ -1008,19 +1961,18 @@ class SetupRunner(object):
             'name': setup_file.meta_data.service_name,
             'schema': setup_file.meta_data.schema_name,
             }
-        data = yaml.dump(meta_data)
+        data = yaml.dump(meta_data, Dumper=SafeDumper)
         blob_oid = repo.create_blob(data)
         builder.insert('consonant.yaml', blob_oid, pygit2.GIT_FILEMODE_BLOB)
 
-    def _populate_store(self, repo, setup_file, author):
-        # obtain a Consonant store for the repository
-        store_location = repo.path
-        factory = consonant.service.factories.ServiceFactory()
-        store = factory.service(store_location)
+    def populate(self, service, setup_file, author):
+        """Populate the master branch of a service from a setup file."""
+        if self.batch_size:
+            return self._populate_in_batches(service, setup_file, author)
 
         # define what to base the initial transaction on
         begin_action = actions.BeginAction(
-            'begin', store.ref('master').head.sha1)
+            'begin', service.ref('master').head.sha1)
 
         # define where to land the initial transaction
         commit_action = actions.CommitAction(
@@ -1029,6 +1981,36 @@ class SetupRunner(object):
             '%s <%s>' % (author.name, author.email), time.strftime('%s %z'),
             'Populate store for board "%s"' % setup_file.board_info.name)
 
+        # create a transaction to populate the store with the initial
+        # board info, views, lanes and users
+        num_objects = self._count_objects(setup_file)
+        self.progress.start('plan', num_objects)
+        t = transaction.Transaction(
+            [begin_action] + self._object_actions(setup_file) +
+            [commit_action])
+        self.progress.finish(num_objects)
+
+        # apply the transaction
+        self.progress.start('apply', num_objects)
+        service.apply_transaction(t)
+        self.progress.finish(num_objects)
+
+    def _object_actions(self, setup_file):
+        # create actions for all the objects
+        action_ids = self._object_action_ids(setup_file)
+        create_actions = self._create_objects(setup_file, action_ids)
+        update_actions = self._update_objects(setup_file, action_ids)
+        raw_actions = self._set_raw_properties(setup_file, action_ids)
+        return create_actions + update_actions + raw_actions
+
+    def _count_objects(self, setup_file):
+        # the board info and all objects defined in the setup file
+        return 1 + sum(len(x) for x in [
+            setup_file.views, setup_file.lanes, setup_file.users,
+            setup_file.cards, setup_file.reasons, setup_file.milestones,
+            setup_file.comments, setup_file.attachments])
+
+    def _object_action_ids(self, setup_file):
         # assign an action ID to each object to be created
         action_ids = {}
         for view in setup_file.views.itervalues():
@@ -1047,20 +2029,608 @@ class SetupRunner(object):
             action_ids[comment] = len(action_ids) + 1
         for attachment in setup_file.attachments.itervalues():
             action_ids[attachment] = len(action_ids) + 1
+        return action_ids
+
+    def plan(self, setup_file):
+        """Return a SetupPlan for populating a store from a setup file.
+
+        The plan is built from the same actions as the ones populate()
+        applies, without touching any repository. Attachments are not
+        read, only their sizes are looked up.
+
+        """
+        plan = SetupPlan()
+        action_ids = self._object_action_ids(setup_file)
+        object_actions = \
+            self._create_objects(setup_file, action_ids) + \
+            self._update_objects(setup_file, action_ids)
+        for action in object_actions:
+            if isinstance(action, actions.CreateAction):
+                plan.objects[action.klass] = \
+                    plan.objects.get(action.klass, 0) + 1
+            for prop in action.properties:
+                plan.references += self._count_references(prop)
+                plan.transaction_size += len(json.dumps(
+                    self._plan_property_data(prop)))
 
-        # create actions for all the objects
-        create_actions = self._create_objects(setup_file, action_ids)
-        update_actions = self._update_objects(setup_file, action_ids)
-        raw_actions = self._set_raw_properties(setup_file, action_ids)
+        for attachment in setup_file.attachments.itervalues():
+            plan.attachments += 1
+            plan.attachment_bytes += os.path.getsize(attachment.path)
+        plan.transaction_size += plan.attachment_bytes
 
-        # create a transaction to populate the store with the initial
-        # board info, views, lanes and users
-        t = transaction.Transaction(
-            [begin_action] + create_actions +
-            update_actions + raw_actions + [commit_action])
+        plan.actions = len(object_actions) + plan.attachments
+        if self.bulk_load or not self.batch_size:
+            plan.commits = 2
+        else:
+            refs = self._index_references(setup_file)
+            batches = self._batch_objects(setup_file, refs)
+            lanes = [x for x in setup_file.lanes.itervalues() if x.cards]
+            plan.commits = 2 + len(batches) + (1 if lanes else 0)
+        return plan
+
+    def _count_references(self, prop):
+        if isinstance(prop, properties.ReferenceProperty):
+            return 1
+        elif isinstance(prop, properties.ListProperty):
+            return sum(self._count_references(x) for x in prop.value)
+        else:
+            return 0
 
-        # apply the transaction
-        store.apply_transaction(t)
+    def _plan_property_data(self, prop):
+        # approximate the serialised form of a property in a transaction
+        if isinstance(prop, properties.ListProperty):
+            return [self._plan_property_data(x) for x in prop.value]
+        else:
+            return {prop.name: prop.value}
+
+    def update(self, service, setup_file, author):
+        """Apply the differences between a setup file and a service.
+
+        Objects in the master branch of the service are matched with
+        those in the setup file by their names, short names or card
+        titles, and comments by their card and content, with identical
+        comments on the same card matched in turn. Objects missing from
+        the store are created, objects whose properties differ are
+        updated and objects missing from the setup file are deleted, all
+        in a single commit. Objects that lose properties which cannot be
+        unset, such as a card's milestone, are deleted and created again.
+        Returns whether the store had to be changed.
+
+        """
+        self.progress.start('plan', self._count_objects(setup_file))
+        commit = service.ref('master').head
+        refs = self._index_references(setup_file)
+
+        # index the objects in the store by the keys of their setup file
+        # counterparts
+        stored = {}
+        for section in ['views', 'lanes', 'users', 'cards', 'reasons',
+                        'milestones', 'comments', 'attachments']:
+            klass = service.klass(commit, section[:-1])
+            stored[section] = service.objects(commit, klass)
+        card_titles = dict((x.uuid, x['title']) for x in stored['cards'])
+        store_list = [(section, obj)
+                      for section, objects in sorted(stored.iteritems())
+                      for obj in objects]
+        store_objects = collections.OrderedDict(zip(
+            self._number_keys(
+                [self._store_object_key(section, card_titles, obj)
+                 for section, obj in store_list]),
+            [obj for _, obj in store_list]))
+
+        # map setup file objects to the store objects they match
+        setup_objects = \
+            setup_file.views.values() + setup_file.lanes.values() + \
+            setup_file.users.values() + setup_file.cards.values() + \
+            setup_file.reasons.values() + setup_file.milestones.values() + \
+            setup_file.comments.values() + setup_file.attachments.values()
+        setup_keys = dict(zip(setup_objects, self._number_keys(
+            [self._setup_object_key(refs, x) for x in setup_objects])))
+        matches = collections.OrderedDict()
+        for obj in setup_objects:
+            key = setup_keys[obj]
+            if key in store_objects:
+                matches[obj] = store_objects.pop(key)
+                refs['uuids'][obj] = matches[obj].uuid
+        new_objects = [x for x in setup_objects if x not in matches]
+        action_ids = self._assign_action_ids(new_objects)
+
+        # objects that lose a property other than a list are recreated,
+        # as properties cannot be unset by updating objects
+        for obj, store_obj in matches.items():
+            props = self._object_properties(setup_file, action_ids, refs, obj)
+            if any(not isinstance(store_obj.properties[x],
+                                  properties.ListProperty)
+                   for x in self._removed_properties(store_obj, props)):
+                del matches[obj]
+                del refs['uuids'][obj]
+                store_objects[setup_keys[obj]] = store_obj
+                new_objects.append(obj)
+                action_ids[obj] = len(action_ids) + 1
+
+        create_actions = []
+        update_actions = []
+        raw_actions = []
+        delete_actions = []
+        attachment_data = {}
+        num_updated = 0
+
+        info_class = service.klass(commit, 'info')
+        infos = service.objects(commit, info_class)
+        create_info = self._create_board_info(setup_file)
+        if infos and self._removed_properties(
+                infos[0], create_info.properties):
+            delete_actions.append(actions.DeleteAction(
+                'delete-info', infos[0].uuid, None))
+            infos = []
+        if not infos:
+            create_actions.append(create_info)
+        else:
+            changed = self._changed_properties(
+                infos[0], create_info.properties)
+            if changed:
+                update_actions.append(actions.UpdateAction(
+                    'update-info', infos[0].uuid, None, changed))
+                num_updated += 1
+
+        # create objects that are missing from the store
+        for obj in new_objects:
+            create_actions.append(self._create_object(
+                setup_file, action_ids, obj))
+            update_actions.append(self._update_object(
+                setup_file, action_ids, refs, obj))
+            if isinstance(obj, Attachment):
+                raw_actions.append(self._set_raw_attachment_property(
+                    setup_file, action_ids, obj, attachment_data))
+
+        # update objects whose properties differ from the setup file and
+        # empty lists that are no longer set in the setup file
+        for index, (obj, store_obj) in enumerate(matches.iteritems()):
+            props = self._object_properties(setup_file, action_ids, refs, obj)
+            for name in self._removed_properties(store_obj, props):
+                props.append(properties.ListProperty(name, []))
+            changed = self._changed_properties(store_obj, props)
+            if changed:
+                update_actions.append(actions.UpdateAction(
+                    'update-existing-%d' % index, store_obj.uuid, None,
+                    changed))
+            if isinstance(obj, Attachment) and \
+                    self._attachment_changed(store_obj, obj):
+                raw_actions.append(actions.UpdateRawPropertyAction(
+                    'set-raw-existing-%d' % index, store_obj.uuid, None,
+                    'data', mimetypes.guess_type(obj.path)[0],
+                    self._read_attachment(obj.path, attachment_data)))
+            elif not changed:
+                continue
+            num_updated += 1
+
+        # delete objects that are no longer in the setup file
+        for index, obj in enumerate(store_objects.itervalues()):
+            delete_actions.append(actions.DeleteAction(
+                'delete-%d' % index, obj.uuid, None))
+
+        self.progress.finish(self._count_objects(setup_file))
+        self.progress.message(
+            'Creating %d, updating %d and deleting %d objects' %
+            (len(create_actions), num_updated, len(delete_actions)))
+        object_actions = \
+            create_actions + update_actions + raw_actions + delete_actions
+        if not object_actions:
+            return False
+
+        begin_action = actions.BeginAction('begin', commit.sha1)
+        commit_action = actions.CommitAction(
+            'commit', 'refs/heads/master',
+            '%s <%s>' % (author.name, author.email), time.strftime('%s %z'),
+            '%s <%s>' % (author.name, author.email), time.strftime('%s %z'),
+            'Update store for board "%s"' % setup_file.board_info.name)
+        num_changed = len(create_actions) + num_updated + len(delete_actions)
+        self.progress.start('apply', num_changed)
+        service.apply_transaction(transaction.Transaction(
+            [begin_action] + object_actions + [commit_action]))
+        self.progress.finish(num_changed)
+        return True
+
+    def _object_properties(self, setup_file, action_ids, refs, obj):
+        # objects never refer to themselves, so the temporary action ID
+        # is only used to build the actions, not in any references
+        action_ids[obj] = 'existing'
+        try:
+            props = self._create_object(setup_file, action_ids, obj) \
+                .properties
+            props += self._update_object(
+                setup_file, action_ids, refs, obj).properties
+        finally:
+            del action_ids[obj]
+        return props
+
+    def _removed_properties(self, store_obj, props):
+        # return the optional properties that the setup file used to set
+        # for an object but no longer does
+        names = set(x.name for x in props)
+        return [x for x in self.optional_properties[store_obj.klass.name]
+                if x in store_obj.properties and x not in names]
+
+    def _setup_object_key(self, refs, obj):
+        if isinstance(obj, View):
+            return ('views', obj.name)
+        elif isinstance(obj, Lane):
+            return ('lanes', obj.name)
+        elif isinstance(obj, User):
+            return ('users', obj.name)
+        elif isinstance(obj, Card):
+            return ('cards', obj.title)
+        elif isinstance(obj, Reason):
+            return ('reasons', obj.short_name)
+        elif isinstance(obj, Milestone):
+            return ('milestones', obj.short_name)
+        elif isinstance(obj, Comment):
+            return ('comments', refs['cards'][obj.card].title, obj.content)
+        else:
+            return ('attachments', obj.name)
+
+    def _store_object_key(self, section, card_titles, obj):
+        if section in ('reasons', 'milestones'):
+            return (section, obj['short-name'])
+        elif section == 'cards':
+            return (section, obj['title'])
+        elif section == 'comments':
+            card_title = None
+            if 'card' in obj.properties:
+                card_title = card_titles.get(obj['card'].uuid)
+            return (section, card_title, obj['comment'])
+        else:
+            return (section, obj['name'])
+
+    def _number_keys(self, keys):
+        # number repeated keys, such as those of identical comments on
+        # the same card, so that every object gets a key of its own
+        counts = collections.defaultdict(int)
+        numbered = []
+        for key in keys:
+            numbered.append(key + (counts[key],))
+            counts[key] += 1
+        return numbered
+
+    def _changed_properties(self, obj, props):
+        return [prop for prop in props
+                if prop.name not in obj.properties
+                or self._property_value(prop) !=
+                self._property_value(obj.properties[prop.name])]
+
+    def _property_value(self, prop):
+        # compare references by UUID and everything else by value, so
+        # that properties built from the setup file can be compared with
+        # those loaded from a store
+        if isinstance(prop, properties.ListProperty):
+            return [self._property_value(x) for x in prop.value]
+        elif isinstance(prop, properties.ReferenceProperty):
+            if isinstance(prop.value, dict):
+                return prop.value.get('uuid', prop.value)
+            else:
+                return prop.value.uuid
+        elif isinstance(prop, properties.TimestampProperty):
+            return str(prop.value)
+        else:
+            return prop.value
+
+    def _attachment_changed(self, store_obj, attachment):
+        if 'data' not in store_obj.properties:
+            return True
+        digest = hashlib.sha1(store_obj.properties['data'].value)
+        return digest.hexdigest() != _hash_file(attachment.path)
+
+    def _populate_in_batches(self, service, setup_file, author):
+        self.progress.start('plan', self._count_objects(setup_file))
+        refs = self._index_references(setup_file)
+        batches = self._batch_objects(setup_file, refs)
+        lanes = [x for x in setup_file.lanes.itervalues() if x.cards]
+        total = 1 + len(batches) + (1 if lanes else 0)
+        self.progress.finish(self._count_objects(setup_file))
+
+        # lanes with cards are written twice, so count them twice
+        self.progress.start(
+            'apply', self._count_objects(setup_file) + len(lanes))
+
+        # first commit: the board info and all objects that cards,
+        # comments and attachments refer to, linked to each other
+        board_objects = \
+            setup_file.views.values() + setup_file.lanes.values() + \
+            setup_file.users.values() + setup_file.reasons.values() + \
+            setup_file.milestones.values()
+        action_ids = self._assign_action_ids(board_objects)
+        create_actions = [self._create_board_info(setup_file)]
+        update_actions = []
+        for obj in board_objects:
+            create_actions.append(self._create_object(
+                setup_file, action_ids, obj))
+            if isinstance(obj, Lane):
+                # cards do not exist yet, so only link lanes to views
+                action_id = action_ids[obj]
+                update_actions.append(actions.UpdateAction(
+                    'update-%s' % action_id, None, action_id,
+                    [self._lane_views(action_ids, refs, obj)]))
+            else:
+                update_actions.append(self._update_object(
+                    setup_file, action_ids, refs, obj))
+        self._apply_batch(
+            service, setup_file, author, 1, total, len(board_objects) + 1,
+            create_actions + update_actions)
+
+        self._find_uuids(service, refs, 'views', 'name', 'name')
+        self._find_uuids(service, refs, 'lanes', 'name', 'name')
+        self._find_uuids(service, refs, 'users', 'name', 'name')
+        self._find_uuids(
+            service, refs, 'reasons', 'short-name', 'short_name')
+        self._find_uuids(
+            service, refs, 'milestones', 'short-name', 'short_name')
+
+        # following commits: cards, comments and attachments in batches
+        # that only refer to each other or to objects created before
+        for index, batch in enumerate(batches):
+            action_ids = self._assign_action_ids(batch)
+            create_actions = []
+            update_actions = []
+            raw_actions = []
+            attachment_data = {}
+            for obj in batch:
+                create_actions.append(self._create_object(
+                    setup_file, action_ids, obj))
+                update_actions.append(self._update_object(
+                    setup_file, action_ids, refs, obj))
+                if isinstance(obj, Attachment):
+                    raw_actions.append(self._set_raw_attachment_property(
+                        setup_file, action_ids, obj, attachment_data))
+            self._apply_batch(
+                service, setup_file, author, index + 2, total, len(batch),
+                create_actions + update_actions + raw_actions)
+
+        # last commit: link lanes to the cards they contain
+        if lanes:
+            # card titles are unique, as cards are stored by title in
+            # the setup file
+            self._find_uuids(service, refs, 'cards', 'title', 'title')
+            update_actions = []
+            for lane in lanes:
+                update_actions.append(actions.UpdateAction(
+                    'update-%s' % refs['uuids'][lane], refs['uuids'][lane],
+                    None, [self._lane_cards({}, refs, lane)]))
+            self._apply_batch(
+                service, setup_file, author, total, total, len(lanes),
+                update_actions)
+        self.progress.finish()
+
+    def _batch_objects(self, setup_file, refs):
+        # group cards, comments and attachments that refer to each other
+        # into clusters, which need to be created in the same commit, and
+        # then fill batches with clusters until they reach the batch size
+        neighbours = collections.OrderedDict()
+        for card in setup_file.cards.itervalues():
+            neighbours[card] = []
+        for comment in setup_file.comments.itervalues():
+            neighbours[comment] = []
+        for attachment in setup_file.attachments.itervalues():
+            neighbours[attachment] = []
+        for card in setup_file.cards.itervalues():
+            for comment_id in card.comments:
+                self._link(neighbours, card, refs['comments'][comment_id])
+        for comment in setup_file.comments.itervalues():
+            self._link(neighbours, comment, refs['cards'][comment.card])
+            if comment.attachment:
+                self._link(neighbours, comment,
+                           refs['attachments'][comment.attachment])
+        for attachment in setup_file.attachments.itervalues():
+            self._link(neighbours, attachment,
+                       refs['comments'][attachment.comment])
+
+        batches = []
+        batch = []
+        visited = set()
+        for obj in neighbours:
+            if obj in visited:
+                continue
+            visited.add(obj)
+            stack = [obj]
+            while stack:
+                obj = stack.pop()
+                batch.append(obj)
+                for other in neighbours[obj]:
+                    if other not in visited:
+                        visited.add(other)
+                        stack.append(other)
+            if len(batch) >= self.batch_size:
+                batches.append(batch)
+                batch = []
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def _link(self, neighbours, obj, other):
+        neighbours[obj].append(other)
+        neighbours[other].append(obj)
+
+    def _assign_action_ids(self, objects):
+        return dict((obj, index + 1) for index, obj in enumerate(objects))
+
+    def _create_object(self, setup_file, action_ids, obj):
+        func_name = '_create_%s' % obj.__class__.__name__.lower()
+        return getattr(self, func_name)(setup_file, action_ids, obj)
+
+    def _update_object(self, setup_file, action_ids, refs, obj):
+        func_name = '_update_%s' % obj.__class__.__name__.lower()
+        return getattr(self, func_name)(setup_file, action_ids, refs, obj)
+
+    def _find_uuids(self, service, refs, section, prop_name, attribute):
+        # look up the UUIDs of objects created in earlier commits by a
+        # property that identifies them uniquely
+        commit = service.ref('master').head
+        klass = service.klass(commit, section[:-1])
+        uuids = dict((obj[prop_name], obj.uuid)
+                     for obj in service.objects(commit, klass))
+        for obj in refs[section].itervalues():
+            refs['uuids'][obj] = uuids[getattr(obj, attribute)]
+
+    def _apply_batch(self, service, setup_file, author, index, total,
+                     num_objects, batch_actions):
+        start = time.time()
+        begin_action = actions.BeginAction(
+            'begin', service.ref('master').head.sha1)
+        commit_action = actions.CommitAction(
+            'commit', 'refs/heads/master',
+            '%s <%s>' % (author.name, author.email), time.strftime('%s %z'),
+            '%s <%s>' % (author.name, author.email), time.strftime('%s %z'),
+            'Populate store for board "%s" (%d/%d)' %
+            (setup_file.board_info.name, index, total))
+        service.apply_transaction(transaction.Transaction(
+            [begin_action] + batch_actions + [commit_action]))
+        self.progress.message(
+            'Committed batch %d/%d with %d objects in %.3fs' %
+            (index, total, num_objects, time.time() - start))
+        self.progress.advance(num_objects)
+
+    def _populate_store(self, repo, setup_file, author):
+        self.populate(self._store(repo), setup_file, author)
+
+    def _bulk_load_store(self, repo, setup_file, author, parent_oid):
+        # apply the actions of the populate transaction to plain dicts
+        # and write the resulting objects into the tree of a commit on
+        # top of the initial commit, bypassing the transaction machinery
+        self.progress.start('plan', self._count_objects(setup_file))
+        action_ids = self._object_action_ids(setup_file)
+        objects, action_uuids = self._apply_actions(
+            repo,
+            self._create_objects(setup_file, action_ids) +
+            self._update_objects(setup_file, action_ids))
+        self.progress.finish(len(objects))
+
+        # stream attachments into blobs instead of passing their data
+        # around in raw property actions
+        attachments = setup_file.attachments.values()
+        for attachment in attachments:
+            obj = objects[action_uuids[action_ids[attachment]]]
+            obj['properties']['data'] = {
+                'content-type': mimetypes.guess_type(attachment.path)[0],
+                }
+
+        # serialise objects and hash attachments in worker processes,
+        # then write the blobs and trees in this process
+        self.progress.start('prepare', len(objects) + len(attachments))
+        serialized, digests = self._prepare_blobs(
+            objects, [x.path for x in attachments])
+        self.progress.finish(len(objects) + len(attachments))
+
+        # blobs are only shared between the attachments of this board,
+        # as a runner may set up several boards in different repositories
+        self.progress.start('commit', len(objects) + len(attachments))
+        blobs = {}
+        for attachment, digest in zip(attachments, digests):
+            obj = objects[action_uuids[action_ids[attachment]]]
+            obj['raw-properties']['data'] = self._attachment_blob(
+                repo, blobs, attachment.path, digest)
+            self.progress.advance()
+
+        builder = repo.TreeBuilder()
+        self._create_meta_data(repo, setup_file, builder)
+        self._write_objects(repo, builder, objects, serialized)
+        tree_oid = builder.write()
+        repo.create_commit(
+            'refs/heads/master',
+            author, author,
+            'Populate store for board "%s"' % setup_file.board_info.name,
+            tree_oid, [parent_oid])
+        self.progress.finish()
+
+    def _apply_actions(self, repo, object_actions):
+        # mimic what applying the actions in a Consonant transaction does,
+        # i.e. create objects with new UUIDs, replace properties on
+        # updates and resolve references to actions into UUIDs
+        objects = collections.OrderedDict()
+        action_uuids = {}
+        for action in object_actions:
+            if isinstance(action, actions.CreateAction):
+                obj_uuid = uuid.uuid4().hex
+                objects[obj_uuid] = {
+                    'class': action.klass,
+                    'properties': {},
+                    'raw-properties': {},
+                    }
+            elif action.uuid:
+                obj_uuid = action.uuid
+            else:
+                obj_uuid = action_uuids[action.action_id]
+            action_uuids[action.id] = obj_uuid
+
+            obj = objects[obj_uuid]
+            if isinstance(action, actions.UpdateRawPropertyAction):
+                obj['properties'][action.property] = {
+                    'content-type': action.content_type,
+                    }
+                obj['raw-properties'][action.property] = \
+                    repo.create_blob(action.data)
+            else:
+                for prop in action.properties:
+                    obj['properties'][prop.name] = self._property_data(
+                        action_uuids, prop)
+        return objects, action_uuids
+
+    def _property_data(self, action_uuids, prop):
+        if isinstance(prop, properties.ReferenceProperty):
+            if 'action' in prop.value:
+                return {'uuid': action_uuids[prop.value['action']]}
+            else:
+                return {'uuid': prop.value['uuid']}
+        elif isinstance(prop, properties.ListProperty):
+            return [self._property_data(action_uuids, x) for x in prop.value]
+        else:
+            return prop.value
+
+    def _prepare_blobs(self, objects, paths):
+        props = [obj['properties'] for obj in objects.itervalues()]
+        if self._use_pool(len(props) + len(paths)):
+            pool = multiprocessing.Pool(self.processes)
+            try:
+                serialized = pool.map(_serialize_properties, props)
+                digests = pool.map(_hash_file, paths)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            serialized = [_serialize_properties(x) for x in props]
+            digests = [_hash_file(x) for x in paths]
+        return serialized, digests
+
+    def _use_pool(self, size):
+        # starting worker processes and passing data to them costs more
+        # than it saves for small boards, so only use them by default if
+        # there is enough work and more than one CPU to spread it over
+        if self.processes is None:
+            return size >= self.parallel_threshold and \
+                multiprocessing.cpu_count() > 1
+        return self.processes > 1 and size > 1
+
+    def _write_objects(self, repo, builder, objects, serialized):
+        # objects are stored as <class>/<uuid>/properties.yaml, with raw
+        # properties stored as separate files next to properties.yaml and
+        # their content types recorded in properties.yaml
+        class_builders = collections.OrderedDict()
+        for (obj_uuid, obj), data in zip(objects.iteritems(), serialized):
+            object_builder = repo.TreeBuilder()
+            for name, blob_oid in obj['raw-properties'].iteritems():
+                object_builder.insert(
+                    name, blob_oid, pygit2.GIT_FILEMODE_BLOB)
+            blob_oid = repo.create_blob(data)
+            object_builder.insert(
+                'properties.yaml', blob_oid, pygit2.GIT_FILEMODE_BLOB)
+
+            if obj['class'] not in class_builders:
+                class_builders[obj['class']] = repo.TreeBuilder()
+            class_builders[obj['class']].insert(
+                obj_uuid, object_builder.write(), pygit2.GIT_FILEMODE_TREE)
+            self.progress.advance()
+
+        for name, class_builder in class_builders.iteritems():
+            builder.insert(
+                name, class_builder.write(), pygit2.GIT_FILEMODE_TREE)
 
     def _create_objects(self, setup_file, action_ids):
         actions = []
@@ -1093,36 +2663,70 @@ class SetupRunner(object):
     def _update_objects(self, setup_file, action_ids):
         actions = []
 
+        # build lookup tables for all kinds of references once
+        refs = self._index_references(setup_file)
+
         # second pass: link all these objects together
         for view in setup_file.views.itervalues():
-            actions.append(self._update_view(setup_file, action_ids, view))
+            actions.append(self._update_view(
+                setup_file, action_ids, refs, view))
         for lane in setup_file.lanes.itervalues():
-            actions.append(self._update_lane(setup_file, action_ids, lane))
+            actions.append(self._update_lane(
+                setup_file, action_ids, refs, lane))
         for user in setup_file.users.itervalues():
-            actions.append(self._update_user(setup_file, action_ids, user))
+            actions.append(self._update_user(
+                setup_file, action_ids, refs, user))
         for card in setup_file.cards.itervalues():
-            actions.append(self._update_card(setup_file, action_ids, card))
+            actions.append(self._update_card(
+                setup_file, action_ids, refs, card))
         for reason in setup_file.reasons.itervalues():
-            actions.append(self._update_reason(setup_file, action_ids, reason))
+            actions.append(self._update_reason(
+                setup_file, action_ids, refs, reason))
         for milestone in setup_file.milestones.itervalues():
             actions.append(self._update_milestone(
-                setup_file, action_ids, milestone))
+                setup_file, action_ids, refs, milestone))
         for comment in setup_file.comments.itervalues():
             actions.append(self._update_comment(
-                setup_file, action_ids, comment))
+                setup_file, action_ids, refs, comment))
         for attachment in setup_file.attachments.itervalues():
             actions.append(self._update_attachment(
-                setup_file, action_ids, attachment))
+                setup_file, action_ids, refs, attachment))
 
         return actions
 
+    def _index_references(self, setup_file):
+        # map the names and ids used in references in the setup file to
+        # the objects they refer to, as well as lane names to the views
+        # that include the lanes
+        refs = {
+            'views': dict((x.name, x) for x in setup_file.views.itervalues()),
+            'lanes': dict((x.name, x) for x in setup_file.lanes.itervalues()),
+            'users': dict((x.name, x) for x in setup_file.users.itervalues()),
+            'cards': dict((x.id, x) for x in setup_file.cards.itervalues()),
+            'reasons': dict((x.short_name, x)
+                            for x in setup_file.reasons.itervalues()),
+            'milestones': dict((x.short_name, x)
+                               for x in setup_file.milestones.itervalues()),
+            'comments': dict((x.id, x)
+                             for x in setup_file.comments.itervalues()),
+            'attachments': dict((x.name, x)
+                                for x in setup_file.attachments.itervalues()),
+            'lane-views': {},
+            'uuids': {},
+            }
+        for view in setup_file.views.itervalues():
+            for name in set(view.lanes):
+                refs['lane-views'].setdefault(name, []).append(view)
+        return refs
+
     def _set_raw_properties(self, setup_file, action_ids):
         actions = []
 
         # third pass: set raw properties
+        attachment_data = {}
         for attachment in setup_file.attachments.itervalues():
             actions.append(self._set_raw_attachment_property(
-                setup_file, action_ids, attachment))
+                setup_file, action_ids, attachment, attachment_data))
 
         return actions
 
@@ -1209,118 +2813,107 @@ class SetupRunner(object):
         props.append(properties.TextProperty('name', attachment.name))
         return actions.CreateAction(action_id, 'attachment', props)
 
-    def _update_view(self, setup_file, action_ids, view):
+    def _reference(self, name, action_ids, refs, obj):
+        # refer to objects created in the same transaction by their action
+        # ID and to objects created in earlier transactions by their UUID
+        if obj in action_ids:
+            return properties.ReferenceProperty(
+                name, {'action': action_ids[obj]})
+        else:
+            return properties.ReferenceProperty(
+                name, {'uuid': refs['uuids'][obj]})
+
+    def _update_view(self, setup_file, action_ids, refs, view):
         references = []
         for name in view.lanes:
-            lane = [x for x in setup_file.lanes.itervalues()
-                    if x.name == name][0]
-            action_id = action_ids[lane]
-            references.append(properties.ReferenceProperty(
-                'lanes', {'action': action_id}))
+            lane = refs['lanes'][name]
+            references.append(self._reference(
+                'lanes', action_ids, refs, lane))
 
         action_id = action_ids[view]
         props = [properties.ListProperty('lanes', references)]
         return actions.UpdateAction(
             'update-%s' % action_id, None, action_id, props)
 
-    def _update_lane(self, setup_file, action_ids, lane):
-        props = []
-        views = [x for x in setup_file.views.itervalues()
-                 if x.lanes and lane.name in x.lanes]
-
-        references = []
-        for view in views:
-            action_id = action_ids[view]
-            references.append(properties.ReferenceProperty(
-                'views', {'action': action_id}))
-
-        props.append(properties.ListProperty('views', references))
-
+    def _update_lane(self, setup_file, action_ids, refs, lane):
+        props = [self._lane_views(action_ids, refs, lane)]
         if lane.cards:
-            cards = [x for x in setup_file.cards.itervalues()
-                     if x.id in lane.cards]
-            references = []
-            for card in cards:
-                action_id = action_ids[card]
-                references.append(properties.ReferenceProperty(
-                    'cards', {'action': action_id}))
-            props.append(properties.ListProperty('cards', references))
+            props.append(self._lane_cards(action_ids, refs, lane))
 
         action_id = action_ids[lane]
         return actions.UpdateAction(
             'update-%s' % action_id, None, action_id, props)
 
-    def _update_user(self, setup_file, action_ids, user):
+    def _lane_views(self, action_ids, refs, lane):
+        views = refs['lane-views'].get(lane.name, [])
+        references = []
+        for view in views:
+            references.append(self._reference(
+                'views', action_ids, refs, view))
+        return properties.ListProperty('views', references)
+
+    def _lane_cards(self, action_ids, refs, lane):
+        cards = [refs['cards'][x] for x in lane.cards]
+        references = []
+        for card in cards:
+            references.append(self._reference(
+                'cards', action_ids, refs, card))
+        return properties.ListProperty('cards', references)
+
+    def _update_user(self, setup_file, action_ids, refs, user):
         props = []
         if user.default_view:
-            default_view = [x for x in setup_file.views.itervalues()
-                            if x.name == user.default_view][0]
-            action_id = action_ids[default_view]
-            props.append(properties.ReferenceProperty(
-                'default-view', {'action': action_id}))
+            default_view = refs['views'][user.default_view]
+            props.append(self._reference(
+                'default-view', action_ids, refs, default_view))
 
         action_id = action_ids[user]
         return actions.UpdateAction(
             'update-%s' % action_id, None, action_id, props)
 
-    def _update_card(self, setup_file, action_ids, card):
+    def _update_card(self, setup_file, action_ids, refs, card):
         props = []
 
         # add creator reference
-        creator = [x for x in setup_file.users.itervalues()
-                   if x.name == card.creator][0]
-        ref = properties.ReferenceProperty(
-            'creator', {'action': action_ids[creator]})
-        props.append(ref)
+        creator = refs['users'][card.creator]
+        props.append(self._reference('creator', action_ids, refs, creator))
 
         # add lane reference
-        lane = [x for x in setup_file.lanes.itervalues()
-                if x.name == card.lane][0]
-        ref = properties.ReferenceProperty(
-            'lane', {'action': action_ids[lane]})
-        props.append(ref)
+        lane = refs['lanes'][card.lane]
+        props.append(self._reference('lane', action_ids, refs, lane))
 
         # add reason reference
-        reason = [x for x in setup_file.reasons.itervalues()
-                  if x.short_name == card.reason][0]
-        ref = properties.ReferenceProperty(
-            'reason', {'action': action_ids[reason]})
-        props.append(ref)
+        reason = refs['reasons'][card.reason]
+        props.append(self._reference('reason', action_ids, refs, reason))
 
         # add milestone reference
         if card.milestone:
-            milestone = [x for x in setup_file.milestones.itervalues()
-                         if x.short_name == card.milestone][0]
-            ref = properties.ReferenceProperty(
-                'milestone', {'action': action_ids[milestone]})
-            props.append(ref)
+            milestone = refs['milestones'][card.milestone]
+            props.append(self._reference(
+                'milestone', action_ids, refs, milestone))
 
         # add assignee references
         if card.assignees:
             references = []
             for name in card.assignees:
-                assignee = [x for x in setup_file.users.itervalues()
-                            if x.name == name][0]
-                action_id = action_ids[assignee]
-                references.append(properties.ReferenceProperty(
-                    'assignees', {'action': action_id}))
+                assignee = refs['users'][name]
+                references.append(self._reference(
+                    'assignees', action_ids, refs, assignee))
             props.append(properties.ListProperty('assignees', references))
 
         if card.comments:
             references = []
             for comment_id in card.comments:
-                comment = [x for x in setup_file.comments.itervalues()
-                           if x.id == comment_id][0]
-                action_id = action_ids[comment]
-                references.append(properties.ReferenceProperty(
-                    'comments', {'action': action_id}))
+                comment = refs['comments'][comment_id]
+                references.append(self._reference(
+                    'comments', action_ids, refs, comment))
             props.append(properties.ListProperty('comments', references))
 
         action_id = action_ids[card]
         return actions.UpdateAction(
             'update-%s' % action_id, None, action_id, props)
 
-    def _update_reason(self, setup_file, action_ids, reason):
+    def _update_reason(self, setup_file, action_ids, refs, reason):
         if reason.work_items:
             # TODO:
             #   This is a reference to a remote repository, currently
@@ -1330,59 +2923,66 @@ class SetupRunner(object):
         return actions.UpdateAction(
             'update-%s' % action_id, None, action_id, [])
 
-    def _update_milestone(self, setup_file, action_ids, milestone):
+    def _update_milestone(self, setup_file, action_ids, refs, milestone):
         props = []
 
         action_id = action_ids[milestone]
         return actions.UpdateAction(
             'update-%s' % action_id, None, action_id, props)
 
-    def _update_comment(self, setup_file, action_ids, comment):
+    def _update_comment(self, setup_file, action_ids, refs, comment):
         props = []
 
         # add author reference
-        author = [x for x in setup_file.users.itervalues()
-                  if x.name == comment.author][0]
-        ref = properties.ReferenceProperty(
-            'author', {'action': action_ids[author]})
-        props.append(ref)
+        author = refs['users'][comment.author]
+        props.append(self._reference('author', action_ids, refs, author))
 
         # add attachment reference
         if comment.attachment:
-            attachment = [x for x in setup_file.attachments.itervalues()
-                          if x.name == comment.attachment][0]
-            ref = properties.ReferenceProperty(
-                'attachment', {'action': action_ids[attachment]})
-            props.append(ref)
+            attachment = refs['attachments'][comment.attachment]
+            props.append(self._reference(
+                'attachment', action_ids, refs, attachment))
 
         # add card reference
-        card = [x for x in setup_file.cards.itervalues()
-                if x.id == comment.card][0]
-        ref = properties.ReferenceProperty(
-            'card', {'action': action_ids[card]})
-        props.append(ref)
+        card = refs['cards'][comment.card]
+        props.append(self._reference('card', action_ids, refs, card))
 
         action_id = action_ids[comment]
         return actions.UpdateAction(
             'update-%s' % action_id, None, action_id, props)
 
-    def _update_attachment(self, setup_file, action_ids, attachment):
+    def _update_attachment(self, setup_file, action_ids, refs, attachment):
         props = []
 
-        comment = [x for x in setup_file.comments.itervalues()
-                   if x.id == attachment.comment][0]
-        ref = properties.ReferenceProperty(
-            'comment', {'action': action_ids[comment]})
-        props.append(ref)
+        comment = refs['comments'][attachment.comment]
+        props.append(self._reference('comment', action_ids, refs, comment))
         action_id = action_ids[attachment]
         return actions.UpdateAction(
             'update-%s' % action_id, None, action_id, props)
 
-    def _set_raw_attachment_property(self, setup_file, action_ids, attachment):
+    def _set_raw_attachment_property(self, setup_file, action_ids, attachment,
+                                     attachment_data):
         mime_type = mimetypes.guess_type(attachment.path)[0]
-        with open(attachment.path, 'rb') as f:
-            data = f.read()
+        data = self._read_attachment(attachment.path, attachment_data)
         action_id = action_ids[attachment]
         return actions.UpdateRawPropertyAction(
             'set-raw-%s' % action_id, None,
             'update-%s' % action_id, 'data', mime_type, data)
+
+    def _read_attachment(self, path, attachment_data):
+        # transactions carry the data of raw properties, so attachments
+        # are read into memory completely. the data of files with
+        # identical content is only held once in the attachment data
+        # dict, which only lives as long as the transaction that the
+        # data is passed to
+        with open(path, 'rb') as stream:
+            data = stream.read()
+        return attachment_data.setdefault(hashlib.sha1(data).hexdigest(), data)
+
+    def _attachment_blob(self, repo, blobs, path, digest):
+        # let libgit2 stream attachments into blobs, so that their data
+        # never has to be held in memory, and only write one blob for
+        # files with identical content
+        if digest not in blobs:
+            blobs[digest] = repo.create_blob_fromdisk(path)
+        return blobs[digest]
@@ -0,0 +1,270 @@
+# Copyright (C) 2014 Codethink Limited.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""An in-memory stand-in for Consonant services, used for benchmarking."""
+
+
+import hashlib
+import time
+import uuid
+
+from consonant.store import properties
+from consonant.transaction import actions
+
+
+class MemoryServiceError(Exception):
+
+    """Errors occuring while applying transactions to a MemoryService."""
+
+    pass
+
+
+class MemoryCommit(object):
+
+    """A commit in a MemoryService."""
+
+    def __init__(self, sha1, author, committer, subject, parents):
+        """Initialise a MemoryCommit."""
+        self.sha1 = sha1
+        self.author = author
+        self.committer = committer
+        self.subject = subject
+        self.parents = parents
+
+
+class MemoryRef(object):
+
+    """A named ref pointing to a commit in a MemoryService."""
+
+    def __init__(self, name, head):
+        """Initialise a MemoryRef."""
+        self.name = name
+        self.head = head
+
+
+class MemoryClass(object):
+
+    """An object class in a MemoryService."""
+
+    def __init__(self, name):
+        """Initialise a MemoryClass."""
+        self.name = name
+
+
+class MemoryReference(object):
+
+    """A reference to an object in a MemoryService."""
+
+    def __init__(self, uuid):
+        """Initialise a MemoryReference."""
+        self.uuid = uuid
+
+
+class MemoryRawProperty(object):
+
+    """A raw property holding binary data and its content type."""
+
+    def __init__(self, name, content_type, data):
+        """Initialise a MemoryRawProperty."""
+        self.name = name
+        self.content_type = content_type
+        self.value = data
+
+
+class MemoryObject(object):
+
+    """An object in a MemoryService, mimicking Consonant objects."""
+
+    def __init__(self, uuid, klass, properties):
+        """Initialise a MemoryObject."""
+        self.uuid = uuid
+        self.klass = klass
+        self.properties = properties
+
+    def __getitem__(self, name):
+        """Return the value of the property with the given name."""
+        return self.properties[name].value
+
+    def __contains__(self, name):
+        """Return whether the object has a property with the given name."""
+        return name in self.properties
+
+    def get(self, name, default=None):
+        """Return the value of a property or a default if it is not set."""
+        if name in self.properties:
+            return self.properties[name].value
+        else:
+            return default
+
+
+class MemoryService(object):
+
+    """A Consonant service backed by plain dicts instead of a git store.
+
+    Only the subset of the service API used by Toucan is implemented:
+    ref(), klass(), objects(), resolve_reference() and apply_transaction().
+    Every call sleeps for the configured latency (in seconds) before
+    returning, which allows to simulate the round-trip times of remote
+    services. The number of calls made to each method is recorded in
+    the calls dict.
+
+    """
+
+    def __init__(self, latency=0.0):
+        """Initialise a MemoryService with an empty root commit."""
+        self.latency = latency
+        self.calls = {}
+
+        self._commits = {}
+        self._snapshots = {}
+        self._refs = {}
+
+        root = self._create_commit(None, None, 'Create store', [], {})
+        self._refs['master'] = MemoryRef('master', root)
+
+    def ref(self, name):
+        """Return the ref with the given name."""
+        self._simulate_call('ref')
+        return self._refs[name]
+
+    def klass(self, commit, name):
+        """Return the object class with the given name in a commit."""
+        self._simulate_call('klass')
+        return MemoryClass(name)
+
+    def objects(self, commit, klass=None):
+        """Return the objects of a class or a dict of all objects by class."""
+        self._simulate_call('objects')
+        snapshot = self._snapshots[commit.sha1]
+        if klass:
+            return [obj for obj in snapshot.itervalues()
+                    if obj.klass.name == klass.name]
+        else:
+            groups = {}
+            for obj in snapshot.itervalues():
+                if obj.klass.name not in groups:
+                    groups[obj.klass.name] = []
+                groups[obj.klass.name].append(obj)
+            return groups
+
+    def resolve_reference(self, reference):
+        """Return the object a reference points to in the master branch."""
+        self._simulate_call('resolve_reference')
+        snapshot = self._snapshots[self._refs['master'].head.sha1]
+        return snapshot[reference.uuid]
+
+    def apply_transaction(self, t):
+        """Apply a transaction and return the commit it produced."""
+        self._simulate_call('apply_transaction')
+
+        begin = t.actions[0]
+        commit = t.actions[-1]
+        if not isinstance(begin, actions.BeginAction):
+            raise MemoryServiceError(
+                'Transaction does not start with a begin action')
+        if not isinstance(commit, actions.CommitAction):
+            raise MemoryServiceError(
+                'Transaction does not end with a commit action')
+
+        target = commit.target.split('/')[-1]
+        if self._refs[target].head.sha1 != begin.source:
+            raise MemoryServiceError(
+                'Transaction is based on %s but %s has advanced to %s' %
+                (begin.source, target, self._refs[target].head.sha1))
+
+        objects = dict(self._snapshots[begin.source])
+        action_uuids = {}
+        for action in t.actions[1:-1]:
+            self._apply_action(objects, action_uuids, action)
+
+        head = self._create_commit(
+            commit.author, commit.committer, commit.message,
+            [begin.source], objects)
+        self._refs[target] = MemoryRef(target, head)
+        return head
+
+    def _apply_action(self, objects, action_uuids, action):
+        if isinstance(action, actions.CreateAction):
+            obj_uuid = uuid.uuid4().hex
+            objects[obj_uuid] = MemoryObject(
+                obj_uuid, MemoryClass(action.klass),
+                self._build_properties(action_uuids, action.properties))
+            action_uuids[action.id] = obj_uuid
+        elif isinstance(action, actions.UpdateAction):
+            obj_uuid = self._target_uuid(action_uuids, action)
+            old = objects[obj_uuid]
+            props = dict(old.properties)
+            props.update(
+                self._build_properties(action_uuids, action.properties))
+            objects[obj_uuid] = MemoryObject(obj_uuid, old.klass, props)
+            action_uuids[action.id] = obj_uuid
+        elif isinstance(action, actions.UpdateRawPropertyAction):
+            obj_uuid = self._target_uuid(action_uuids, action)
+            old = objects[obj_uuid]
+            props = dict(old.properties)
+            props[action.property] = MemoryRawProperty(
+                action.property, action.content_type, action.data)
+            objects[obj_uuid] = MemoryObject(obj_uuid, old.klass, props)
+            action_uuids[action.id] = obj_uuid
+        elif isinstance(action, actions.DeleteAction):
+            obj_uuid = self._target_uuid(action_uuids, action)
+            del objects[obj_uuid]
+        else:
+            raise MemoryServiceError(
+                'Unsupported transaction action: %s' % action)
+
+    def _target_uuid(self, action_uuids, action):
+        if action.uuid:
+            return action.uuid
+        else:
+            return action_uuids[action.action_id]
+
+    def _build_properties(self, action_uuids, props):
+        return dict((prop.name, self._build_property(action_uuids, prop))
+                    for prop in props)
+
+    def _build_property(self, action_uuids, prop):
+        if isinstance(prop, properties.ReferenceProperty):
+            value = prop.value
+            if isinstance(value, dict):
+                if 'action' in value:
+                    obj_uuid = action_uuids[value['action']]
+                else:
+                    obj_uuid = value['uuid']
+                value = MemoryReference(obj_uuid)
+            else:
+                value = MemoryReference(value.uuid)
+            return properties.ReferenceProperty(prop.name, value)
+        elif isinstance(prop, properties.ListProperty):
+            return properties.ListProperty(
+                prop.name, [self._build_property(action_uuids, x)
+                            for x in prop.value])
+        else:
+            return prop
+
+    def _create_commit(self, author, committer, subject, parents, objects):
+        digest = hashlib.sha1()
+        digest.update(repr((subject, parents, len(self._commits))))
+        commit = MemoryCommit(
+            digest.hexdigest(), author, committer, subject, parents)
+        self._commits[commit.sha1] = commit
+        self._snapshots[commit.sha1] = objects
+        return commit
+
+    def _simulate_call(self, name):
+        self.calls[name] = self.calls.get(name, 0) + 1
+        if self.latency > 0:
+            time.sleep(self.latency)